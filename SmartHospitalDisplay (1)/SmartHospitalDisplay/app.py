@@ -1,11 +1,31 @@
 import os
+import re
+import sys
+import json
+import hashlib
+import queue
+import select
 import logging
-from datetime import datetime, date, time
-from flask import Flask, render_template, request, jsonify
+import threading
+from collections import Counter, defaultdict
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date, time, timedelta, timezone
+from functools import wraps
+from time import sleep, monotonic, perf_counter
+from zoneinfo import ZoneInfo
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import DeclarativeBase, Session
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+try:
+    import orjson
+except ImportError:  # optional: JSON responses fall back to the standard library encoder
+    orjson = None
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -27,6 +47,14 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# Routes over their declared SQL statement budget are 'off' (ignored), 'warn' (logged) or 'raise' (500, for tests and CI)
+app.config["QUERY_BUDGET_MODE"] = os.environ.get("QUERY_BUDGET_MODE", "off")
+# Statements slower than this many milliseconds get their query plan logged; 0 disables
+app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", 0))
+# Where pages open the live change stream. Empty (the default) has them poll instead, since
+# an open stream holds a sync gunicorn worker for as long as the page is up; set it to
+# /api/stream once that path is routed to push_gateway.py
+app.config["LIVE_STREAM_URL"] = os.environ.get("LIVE_STREAM_URL", "")
 
 # Initialize the app with the extension
 db.init_app(app)
@@ -44,6 +72,94 @@ def create_tables():
 # Initialize database tables when app starts
 create_tables()
 
+# Per-request timings, filled in while a request is being handled (see Request metrics)
+request_stats = threading.local()
+
+
+def timed_serialization(to_dict):
+    """Count the time spent in a model's to_dict() towards the current request"""
+    @wraps(to_dict)
+    def timed(self):
+        if not getattr(request_stats, 'active', False):
+            return to_dict(self)
+        start = perf_counter()
+        try:
+            return to_dict(self)
+        finally:
+            request_stats.serialization_seconds += perf_counter() - start
+    return timed
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding with orjson when it is installed and
+    counting encoding time (jsonify and cached bodies) towards the request
+    """
+
+    def encode(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        # Same output as Flask's encoder: sorted keys, and datetimes left to its default (HTTP dates)
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+
+    def dumps(self, obj, **kwargs):
+        if not getattr(request_stats, 'active', False):
+            return self.encode(obj, **kwargs)
+        start = perf_counter()
+        try:
+            return self.encode(obj, **kwargs)
+        finally:
+            request_stats.serialization_seconds += perf_counter() - start
+
+
+app.json = TimedJSONProvider(app)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(limit):
+    """Declare the most SQL statements a route may run per request, however much data there is.
+
+    Enforced according to QUERY_BUDGET_MODE, so a change that adds a query per
+    row fails in tests instead of slowing down the wards. In 'raise' mode a
+    write over budget fails before it commits; once committed it is only
+    logged, so a client is never told that a saved write failed and retries it.
+    """
+    def decorate(view):
+        @wraps(view)
+        def budgeted(*args, **kwargs):
+            request_stats.query_budget = limit
+            try:
+                response = view(*args, **kwargs)
+            finally:
+                request_stats.query_budget = None
+            used = getattr(request_stats, 'sql_queries', 0)
+            mode = app.config["QUERY_BUDGET_MODE"]
+            if used > limit and mode != 'off':
+                message = f"{request.method} {request.path} ran {used} SQL statements, over its budget of {limit}"
+                if mode == 'raise' and request.method in ('GET', 'HEAD'):
+                    raise QueryBudgetExceeded(message)
+                logging.warning(message)
+            return response
+        budgeted.query_budget = limit
+        return budgeted
+    return decorate
+
+
+@event.listens_for(Session, 'before_commit')
+def check_query_budget_before_commit(session):
+    """In 'raise' mode, fail a write that is already over its route's budget while it can still roll back"""
+    limit = getattr(request_stats, 'query_budget', None)
+    used = getattr(request_stats, 'sql_queries', 0)
+    if limit is not None and used > limit and app.config["QUERY_BUDGET_MODE"] == 'raise':
+        raise QueryBudgetExceeded(
+            f"{request.method} {request.path} ran {used} SQL statements before committing, over its budget of {limit}"
+        )
+
 # Define models inline to avoid circular import
 class Token(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,6 +171,21 @@ class Token(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # At most one token per department may be "now serving"
+        db.Index('uq_token_current_department', 'department', unique=True,
+                 postgresql_where=db.text('is_current'), sqlite_where=db.text('is_current')),
+        # Waiting queue, all departments (get_tokens) and per department (advance_token)
+        db.Index('ix_token_queue', 'status', 'is_current', 'created_at',
+                 postgresql_where=db.text("status = 'waiting' AND NOT is_current")),
+        db.Index('ix_token_department_queue', 'department', 'status', 'is_current', 'created_at',
+                 postgresql_where=db.text("status = 'waiting' AND NOT is_current")),
+        # SQLite can't match partial indexes against bound parameters, so it
+        # needs a plain index for the "now serving" lookup as well
+        db.Index('ix_token_current', 'is_current', 'department').ddl_if(dialect='sqlite'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -63,10 +194,73 @@ class Token(db.Model):
             'patient_type': self.patient_type,
             'status': self.status,
             'is_current': self.is_current,
-            'timestamp': self.created_at.isoformat()
+            'timestamp': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class TokenHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, nullable=False)  # id the token had in the live table
+    department = db.Column(db.String(100), nullable=False)
+    token_number = db.Column(db.String(20), nullable=False)
+    patient_type = db.Column(db.String(50))
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_token_history_created', 'created_at'),
+        db.Index('ix_token_history_department_created', 'department', 'created_at'),
+    )
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'id': self.token_id,
+            'department': self.department,
+            'token_number': self.token_number,
+            'patient_type': self.patient_type,
+            'status': self.status,
+            'timestamp': self.created_at.isoformat() if self.created_at else None,
+            'archived_at': self.archived_at.isoformat() if self.archived_at else None
+        }
+
+
+class TokenCounter(db.Model):
+    department = db.Column(db.String(100), primary_key=True)
+    prefix = db.Column(db.String(10), nullable=False)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+    counter_date = db.Column(db.Date, nullable=False, default=date.today)
+    daily_reset = db.Column(db.Boolean, nullable=False, default=True)
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'department': self.department,
+            'prefix': self.prefix,
+            'last_number': self.last_number,
+            'counter_date': self.counter_date.isoformat() if self.counter_date else None,
+            'daily_reset': self.daily_reset
         }
 
 
+class TokenChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # the change cursor handed to clients
+    token_id = db.Column(db.Integer, nullable=False)
+    department = db.Column(db.String(100), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_token_change_department', 'department', 'id'),
+        # Finds the changes still inside the cursor's settle window
+        db.Index('ix_token_change_changed_at', 'changed_at'),
+        # Cursor ids must never be reused after the log is trimmed
+        {'sqlite_autoincrement': True},
+    )
+
+
 class InventoryItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, unique=True)
@@ -80,6 +274,16 @@ class InventoryItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Items at or below their reorder threshold: quantity - min_threshold <= 0
+        db.Index('ix_inventory_item_stock_margin', quantity - min_threshold, id),
+        db.Index('ix_inventory_item_expiry', 'expiry_date', 'id'),
+        # Keyset pages of the filtered listing, in name order
+        db.Index('ix_inventory_item_category_name', 'category', 'name'),
+        db.Index('ix_inventory_item_type_name', 'item_type', 'name'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -94,6 +298,35 @@ class InventoryItem(db.Model):
         }
 
 
+class StockMovement(db.Model):
+    """Append-only ledger of inventory changes; item quantities are its running totals"""
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(20), nullable=False)  # 'opening', 'add', 'subtract' or 'set'
+    change = db.Column(db.Integer, nullable=False)
+    quantity_after = db.Column(db.Integer, nullable=False)
+    actor = db.Column(db.String(100), nullable=True)
+    note = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stock_movement_item', 'item_id', 'id'),
+    )
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'operation': self.operation,
+            'change': self.change,
+            'quantity_after': self.quantity_after,
+            'actor': self.actor,
+            'note': self.note,
+            'timestamp': self.created_at.isoformat()
+        }
+
+
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     alert_type = db.Column(db.String(50), nullable=False)
@@ -103,7 +336,18 @@ class Alert(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     dismissed_at = db.Column(db.DateTime, nullable=True)
     created_by = db.Column(db.String(100), default='System')
+    source_key = db.Column(db.String(100), nullable=True)  # e.g. 'low_stock:12' for alerts raised by the system
+
+    __table_args__ = (
+        # One active alert per condition, however many workers raise it
+        db.Index('uq_alert_active_source', 'source_key', unique=True,
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+        # Reloading the active set, and keyset pages of the dismissed history
+        db.Index('ix_alert_active', 'is_active', 'created_at'),
+        db.Index('ix_alert_dismissed', 'dismissed_at', 'id'),
+    )
 
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -134,6 +378,12 @@ class Schedule(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Day and date-range lookups, split by OT and consultation
+        db.Index('ix_schedule_date_type', 'schedule_date', 'schedule_type'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -153,10 +403,539 @@ class Schedule(db.Model):
             'remaining': self.total_appointments - self.completed_appointments
         }
 
+# Column-projected serialization
+def time_of_day(value):
+    return value.strftime('%H:%M')
+
+
+# How each column type is written out, matching the models' to_dict()
+COLUMN_CONVERTERS = {datetime: datetime.isoformat, date: date.isoformat, time: time_of_day}
+
+
+class RowSerializer:
+    """A model's to_dict(), precompiled for rows of just the columns it reads.
+
+    Querying `columns` returns plain tuples, with no ORM objects to build or
+    track in the session. Calling the serializer on a row gives the same dict
+    as to_dict(), with each column's conversion chosen once from its type.
+    """
+
+    def __init__(self, fields, derived=None):
+        self.columns = tuple(fields.values())
+        self._keys = tuple(fields)
+        self._converted = tuple(
+            (index, key, COLUMN_CONVERTERS[column.type.python_type])
+            for index, (key, column) in enumerate(fields.items())
+            if column.type.python_type in COLUMN_CONVERTERS
+        )
+        self._derived = tuple((derived or {}).items())
+
+    def __call__(self, row):
+        item = dict(zip(self._keys, row))
+        for index, key, convert in self._converted:
+            if row[index] is not None:
+                item[key] = convert(row[index])
+        for key, derive in self._derived:
+            item[key] = derive(item)
+        return item
+
+    def all(self, rows):
+        """Serialize every row, counting the time towards the current request as to_dict() does"""
+        if not getattr(request_stats, 'active', False):
+            return [self(row) for row in rows]
+        start = perf_counter()
+        try:
+            return [self(row) for row in rows]
+        finally:
+            request_stats.serialization_seconds += perf_counter() - start
+
+
+token_row = RowSerializer({
+    'id': Token.id,
+    'department': Token.department,
+    'token_number': Token.token_number,
+    'patient_type': Token.patient_type,
+    'status': Token.status,
+    'is_current': Token.is_current,
+    'timestamp': Token.created_at,
+    'updated_at': Token.updated_at
+})
+
+inventory_row = RowSerializer({
+    'id': InventoryItem.id,
+    'name': InventoryItem.name,
+    'quantity': InventoryItem.quantity,
+    'unit': InventoryItem.unit,
+    'min_threshold': InventoryItem.min_threshold,
+    'max_capacity': InventoryItem.max_capacity,
+    'category': InventoryItem.category,
+    'item_type': InventoryItem.item_type,
+    'expiry_date': InventoryItem.expiry_date
+})
+
+schedule_row = RowSerializer({
+    'id': Schedule.id,
+    'schedule_type': Schedule.schedule_type,
+    'department': Schedule.department,
+    'doctor': Schedule.doctor_name,
+    'procedure': Schedule.procedure_name,
+    'patient_id': Schedule.patient_id,
+    'room': Schedule.room_number,
+    'start_time': Schedule.start_time,
+    'end_time': Schedule.end_time,
+    'date': Schedule.schedule_date,
+    'status': Schedule.status,
+    'anesthesiologist': Schedule.anesthesiologist,
+    'total_appointments': Schedule.total_appointments,
+    'completed': Schedule.completed_appointments
+}, derived={'remaining': lambda schedule: schedule['total_appointments'] - schedule['completed']})
+
 # Create database tables within app context
 with app.app_context():
     db.create_all()
 
+# Live change feed
+CHANGE_CHANNEL = 'hospital_changes'
+CHANGE_RESOURCES = ('tokens', 'alerts', 'inventory', 'schedules')
+SSE_KEEPALIVE_SECONDS = 15
+SSE_SUBSCRIBER_BACKLOG = 100
+NOTIFY_PAYLOAD_LIMIT = 7900  # bytes per NOTIFY; PostgreSQL rejects payloads of 8000 bytes or more
+CHANGE_EVENT_MAX_ROWS = 500  # beyond this, displays are told to reload instead of applying a delta
+# Seconds before in-memory views reload from the database anyway, in case the change
+# feed missed another worker's writes (SQLite with several workers, or LISTEN down)
+MEMORY_VIEW_MAX_AGE = 60
+
+
+class ChangeBroker:
+    """Fan out committed data changes to the display streams of this worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listeners = {resource: [] for resource in CHANGE_RESOURCES}
+        self.versions = {resource: 0 for resource in CHANGE_RESOURCES}
+
+    def add_listener(self, resource, callback):
+        """Call callback(changes) for every change to resource; None means "reload"."""
+        self._listeners[resource].append(callback)
+
+    def _notify_listeners(self, resource, changes):
+        # Before the version moves, so a read at the new version sees the change
+        for callback in self._listeners[resource]:
+            callback(changes)
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SSE_SUBSCRIBER_BACKLOG)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def bump(self, resource, changes=None):
+        self._notify_listeners(resource, changes)
+        with self._lock:
+            self.versions[resource] += 1
+
+    def publish(self, resource, changes):
+        self._notify_listeners(resource, changes)
+        with self._lock:
+            self.versions[resource] += 1
+            event = {"resource": resource, "version": self.versions[resource], "changes": changes}
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._deliver(subscriber, event)
+
+    def resync(self):
+        """Tell every stream to reload, e.g. after notifications may have been missed"""
+        for resource in self._listeners:
+            self._notify_listeners(resource, None)
+        with self._lock:
+            for resource in self.versions:
+                self.versions[resource] += 1
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._deliver(subscriber, {"resource": "resync", "versions": dict(self.versions)})
+
+    def _deliver(self, subscriber, event):
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # A stalled display gets a full reload instead of an unbounded backlog
+            with subscriber.mutex:
+                subscriber.queue.clear()
+            subscriber.put_nowait({"resource": "resync", "versions": dict(self.versions)})
+
+
+change_broker = ChangeBroker()
+_change_listener_started = False
+_change_listener_lock = threading.Lock()
+
+
+def _uses_postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def notify_payloads(resource, changes):
+    """NOTIFY payloads for a change, packing rows into as few as fit NOTIFY_PAYLOAD_LIMIT.
+
+    Returns None when a single row is over the limit on its own.
+    """
+    if not changes:
+        return [json.dumps({"resource": resource, "changes": changes})]
+    # json.dumps escapes non-ASCII by default, so characters are bytes
+    head = f'{{"resource": {json.dumps(resource)}, "changes": ['
+    room = NOTIFY_PAYLOAD_LIMIT - len(head) - len(']}')
+    payloads = []
+    rows = []
+    size = 0
+    for row in map(json.dumps, changes):
+        if len(row) > room:
+            return None
+        if rows and size + len(', ') + len(row) > room:
+            payloads.append(head + ', '.join(rows) + ']}')
+            rows, size = [], 0
+        size += len(row) + (len(', ') if rows else 0)
+        rows.append(row)
+    payloads.append(head + ', '.join(rows) + ']}')
+    return payloads
+
+
+def notify_change(resource, changes):
+    """Announce committed changes to every display stream.
+
+    On PostgreSQL the event goes through NOTIFY so that streams held by other
+    gunicorn workers see it too; otherwise it is published in-process.
+    `changes` of None means "reload this resource".
+    """
+    if changes is not None and len(changes) > CHANGE_EVENT_MAX_ROWS:
+        changes = None
+    try:
+        if _uses_postgresql():
+            payloads = notify_payloads(resource, changes)
+            if payloads is None:
+                # A row too large for a notification of its own
+                changes = None
+                payloads = notify_payloads(resource, None)
+            with db.engine.begin() as connection:
+                for payload in payloads:
+                    connection.execute(db.text("SELECT pg_notify(:channel, :payload)"),
+                                       {"channel": CHANGE_CHANNEL, "payload": payload})
+            # Don't wait for our own notification before serving fresh reads
+            change_broker.bump(resource, changes)
+        else:
+            change_broker.publish(resource, changes)
+    except Exception as e:
+        logging.error(f"Error publishing {resource} change: {e}")
+        change_broker.resync()
+
+
+def _listen_for_changes():
+    """Relay PostgreSQL notifications from all workers to this worker's streams"""
+    while True:
+        try:
+            with app.app_context():
+                connection = db.engine.raw_connection()
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+            # Anything committed while we were disconnected is unknown
+            change_broker.resync()
+            while True:
+                if select.select([dbapi_connection], [], [], SSE_KEEPALIVE_SECONDS) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    event = json.loads(notification.payload)
+                    change_broker.publish(event['resource'], event['changes'])
+        except Exception as e:
+            logging.error(f"Change listener disconnected: {e}")
+            sleep(5)
+
+
+def ensure_change_listener():
+    """Start the PostgreSQL notification listener once per worker"""
+    global _change_listener_started
+    if _change_listener_started or not _uses_postgresql():
+        return
+    with _change_listener_lock:
+        if not _change_listener_started:
+            threading.Thread(target=_listen_for_changes, name='change-listener', daemon=True).start()
+            _change_listener_started = True
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_greeting():
+    """The first message on a display stream: its reconnect delay and the current versions"""
+    return "retry: 3000\n\n" + format_sse('hello', {"versions": dict(change_broker.versions)})
+
+
+def format_stream_event(event, locations):
+    """A change broker event as SSE for a display at `locations`, or None when it concerns none of them"""
+    # The same event object goes to every stream, so copy rather than mutate it
+    resource = event['resource']
+    data = {key: value for key, value in event.items() if key != 'resource'}
+    if resource == 'tokens':
+        data['service_rates'] = service_rates.minutes_per_token()
+    if resource == 'alerts' and locations and data['changes'] is not None:
+        data['changes'] = [alert for alert in data['changes'] if alert_targets(alert, locations)]
+        if not data['changes']:
+            return None
+    return format_sse(resource, data)
+
+# Active alerts held in memory
+class ActiveAlertSet:
+    """The active alerts, kept current from the change feed and reloaded every MEMORY_VIEW_MAX_AGE seconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alerts = None  # id -> alert dict; None until loaded or after a reload is due
+        self._loaded_at = 0.0
+        self._dismissed = {}  # id -> when its dismissal arrived
+        self._changes_seen = 0
+
+    def apply(self, changes):
+        with self._lock:
+            self._changes_seen += 1
+            if changes is None:
+                self._alerts = None
+            elif self._alerts is not None:
+                for alert in changes:
+                    # Dismissal is final, so a late notification can't revive an alert
+                    if alert['active'] and alert['id'] not in self._dismissed:
+                        self._alerts[alert['id']] = alert
+                    else:
+                        self._dismissed[alert['id']] = monotonic()
+                        self._alerts.pop(alert['id'], None)
+
+    def active(self):
+        """Active alert dicts, newest first"""
+        with self._lock:
+            alerts = self._alerts
+            seen = self._changes_seen
+            if alerts is not None and monotonic() - self._loaded_at >= MEMORY_VIEW_MAX_AGE:
+                alerts = None
+        if alerts is None:
+            loaded_at = monotonic()
+            alerts = {alert.id: alert.to_dict() for alert in
+                      Alert.query.filter_by(is_active=True).order_by(Alert.created_at.desc()).all()}
+            with self._lock:
+                # A change that arrived while we queried may be missing from this load
+                if self._changes_seen == seen:
+                    self._alerts = alerts
+                    self._loaded_at = loaded_at
+                    # Older dismissals are in what the database just returned; only
+                    # recent ones still need guarding against a late notification
+                    self._dismissed = {alert_id: dismissed_at for alert_id, dismissed_at in self._dismissed.items()
+                                       if loaded_at - dismissed_at < MEMORY_VIEW_MAX_AGE}
+        return sorted(alerts.values(), key=lambda alert: (alert['timestamp'], alert['id']), reverse=True)
+
+
+# Service rate per department
+SERVICE_RATE_WEIGHT = 0.2  # share of the newest interval in the running mean
+SERVICE_BREAK_SECONDS = 30 * 60  # longer gaps between advances are breaks, not consultations
+
+
+class ServiceRates:
+    """Exponentially weighted mean time between advances per department.
+
+    Fed by the tokens change feed, so every worker hears about every advance;
+    each one costs O(1) and reads never touch the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_advance = {}  # department -> (updated_at, token id) of its latest promotion
+        self._mean_seconds = {}
+
+    def apply(self, changes):
+        for token in changes or ():
+            if not (token['is_current'] and token['status'] == 'in_progress' and token['updated_at']):
+                continue
+            department = token['department']
+            advanced_at = datetime.fromisoformat(token['updated_at'])
+            with self._lock:
+                last = self._last_advance.get(department)
+                # A worker hears its own advances twice, directly and through NOTIFY
+                if last and (token['id'] == last[1] or advanced_at <= last[0]):
+                    continue
+                self._last_advance[department] = (advanced_at, token['id'])
+                if not last:
+                    continue
+                interval = (advanced_at - last[0]).total_seconds()
+                if interval <= SERVICE_BREAK_SECONDS:
+                    mean = self._mean_seconds.get(department)
+                    self._mean_seconds[department] = interval if mean is None else mean + SERVICE_RATE_WEIGHT * (interval - mean)
+
+    def minutes_per_token(self):
+        """Estimated minutes per token, for departments with enough advances to tell"""
+        with self._lock:
+            return {department: round(mean / 60, 1) for department, mean in self._mean_seconds.items()}
+
+
+service_rates = ServiceRates()
+change_broker.add_listener('tokens', service_rates.apply)
+
+
+# Daily schedule views held in memory
+SCHEDULE_DAYS_CACHED = 31
+
+
+class ScheduleDays:
+    """Each day's schedules, loaded when first asked for, kept current from the change feed
+    and reloaded once they are MEMORY_VIEW_MAX_AGE seconds old"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = {}  # date -> {schedule id: schedule dict}, least recently used first
+        self._loaded_at = {}  # date -> when it was read from the database
+        self._changes_seen = 0
+
+    def apply(self, changes):
+        with self._lock:
+            self._changes_seen += 1
+            if changes is None:
+                self._days.clear()
+                self._loaded_at.clear()
+                return
+            for schedule in changes:
+                # A schedule moved to another date leaves the day it was on
+                for schedules in self._days.values():
+                    schedules.pop(schedule['id'], None)
+                schedules = self._days.get(date.fromisoformat(schedule['date']))
+                if schedules is not None:
+                    schedules[schedule['id']] = schedule
+
+    def day(self, schedule_date):
+        """Schedule dicts for one date, in start time order"""
+        with self._lock:
+            schedules = self._days.pop(schedule_date, None)
+            if schedules is not None and monotonic() - self._loaded_at[schedule_date] < MEMORY_VIEW_MAX_AGE:
+                self._days[schedule_date] = schedules
+                return sorted(schedules.values(), key=lambda schedule: (schedule['start_time'], schedule['id']))
+            self._loaded_at.pop(schedule_date, None)
+            seen = self._changes_seen
+        loaded_at = monotonic()
+        rows = db.session.query(*schedule_row.columns).filter(Schedule.schedule_date == schedule_date)
+        schedules = {schedule['id']: schedule for schedule in schedule_row.all(rows)}
+        with self._lock:
+            # A change that arrived while we queried may be missing from this load
+            if self._changes_seen == seen:
+                self._days[schedule_date] = schedules
+                self._loaded_at[schedule_date] = loaded_at
+                if len(self._days) > SCHEDULE_DAYS_CACHED:
+                    oldest = next(iter(self._days))
+                    del self._days[oldest]
+                    del self._loaded_at[oldest]
+        return sorted(schedules.values(), key=lambda schedule: (schedule['start_time'], schedule['id']))
+
+
+schedule_days = ScheduleDays()
+change_broker.add_listener('schedules', schedule_days.apply)
+
+
+# Alerts of these types reach every display, wherever they were raised
+HOSPITAL_WIDE_ALERT_TYPES = ('code_blue', 'code_red', 'emergency')
+
+
+def normalize_name(name):
+    """Case- and whitespace-insensitive form of a location or person's name"""
+    return ' '.join((name or '').split()).casefold()
+
+
+def display_locations(location):
+    """The normalized names a display registered for `location` answers to.
+
+    A department key also matches alerts raised against its display name, so
+    'cardiology' and 'Cardiology' reach the same screens. Empty for a display
+    registered nowhere, which shows every alert.
+    """
+    location = normalize_name(location)
+    if not location:
+        return frozenset()
+    return frozenset({location, normalize_name(DEPARTMENT_NAMES.get(location))} - {''})
+
+
+def alert_targets(alert, locations):
+    """Whether an alert dict belongs on a display registered for `locations`"""
+    if not locations or alert['type'] in HOSPITAL_WIDE_ALERT_TYPES:
+        return True
+    location = normalize_name(alert['location'])
+    return not location or location in locations
+
+
+active_alerts = ActiveAlertSet()
+change_broker.add_listener('alerts', active_alerts.apply)
+
+# Read-model cache
+READ_CACHE_MAX_AGE = 60  # seconds; bounds staleness if a change notification is ever missed
+READ_CACHE_MAX_ENTRIES = 1000  # paginated views add a key per page
+
+
+class ReadCache:
+    """Rendered GET bodies, reused until the version of their resources changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key, version, build):
+        entry = self._entries.get(key)
+        if entry and entry['version'] == version and monotonic() - entry['built_at'] < READ_CACHE_MAX_AGE:
+            return entry
+
+        body = build()
+        entry = {
+            'version': version,
+            'built_at': monotonic(),
+            'body': body,
+            # Content hash, so the same tag means the same bytes on every worker
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > READ_CACHE_MAX_ENTRIES:
+                oldest = min(self._entries, key=lambda cached: self._entries[cached]['built_at'])
+                del self._entries[oldest]
+        return entry
+
+
+read_cache = ReadCache()
+
+
+def cached_entry(resources, key, render):
+    ensure_change_listener()
+    # Read the versions before building so a concurrent write forces a rebuild next time
+    version = tuple(change_broker.versions[resource] for resource in resources)
+    return read_cache.get(key, version, render)
+
+
+def conditional_response(entry, mimetype):
+    response = Response(entry['body'], mimetype=mimetype)
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def cached_json_response(resource, build, key=None):
+    """Serve a GET payload from the read cache, answering 304 when the client's ETag still matches"""
+    entry = cached_entry((resource,), key or resource, lambda: app.json.dumps(build()))
+    return conditional_response(entry, 'application/json')
+
+
+def department_display_entry(department):
+    """The rendered queue and alerts fragment for one department's ward display"""
+    return cached_entry(('tokens', 'alerts'), f"display:{department}", lambda: render_template(
+        'department_display.html', **build_department_display(department)
+    ))
+
 # Routes
 @app.route('/')
 def dashboard():
@@ -168,151 +947,1626 @@ def patient_display():
     """Patient-facing display showing tokens and alerts"""
     return render_template('patient.html')
 
+@app.route('/patient/<department>')
+@query_budget(3)
+def department_display(department):
+    """Minimal server-rendered display for a single department's ward screen"""
+    entry = department_display_entry(department)
+    return render_template('patient_department.html', department=department, fragment=entry['body'])
+
+@app.route('/patient/<department>/fragment')
+@query_budget(3)
+def department_display_fragment(department):
+    """Just the rendered queue and alerts, for the ward screen to swap in"""
+    try:
+        return conditional_response(department_display_entry(department), 'text/html')
+    except Exception as e:
+        logging.error(f"Error rendering {department} display: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/staff')
 def staff_panel():
     """Staff control panel for managing alerts and viewing inventory"""
     return render_template('staff.html')
 
-# API Routes for Tokens
-@app.route('/api/tokens', methods=['GET'])
-def get_tokens():
-    """Get current token information"""
-    try:
-        # Get current tokens (one per department)
-        current_tokens = {}
-        current_token_objects = Token.query.filter_by(is_current=True).all()
-        for token in current_token_objects:
-            current_tokens[token.department] = token.token_number
-
-        # Get queue tokens
-        queue = {}
-        queue_tokens = Token.query.filter_by(is_current=False, status='waiting').order_by(Token.created_at).all()
-        for token in queue_tokens:
-            if token.department not in queue:
-                queue[token.department] = []
-            queue[token.department].append(token.to_dict())
+# Server-Sent Events stream
+@app.route('/api/stream')
+def stream_changes():
+    """Push token, alert, inventory and schedule changes to connected displays.
 
-        return jsonify({
-            "current_tokens": current_tokens,
-            "queue": queue,
-            "last_updated": datetime.utcnow().isoformat()
-        })
-    except Exception as e:
-        logging.error(f"Error getting tokens: {e}")
-        return jsonify({"error": str(e)}), 500
+    A display that passes ?location= only hears about alerts targeted at it.
+    """
+    ensure_change_listener()
+    locations = display_locations(request.args.get('location'))
+    subscriber = change_broker.subscribe()
 
-@app.route('/api/tokens', methods=['POST'])
-def update_tokens():
-    """Update token information"""
-    try:
-        data = request.get_json()
-        
-        if 'department' in data and 'token_number' in data:
-            # Add new token to queue
-            new_token = Token(
-                department=data['department'],
-                token_number=data['token_number'],
-                patient_type=data.get('patient_type', 'General'),
-                status='waiting',
-                is_current=False
-            )
-            db.session.add(new_token)
-            db.session.commit()
-            
-            return jsonify({"status": "success", "message": "Token added successfully"})
-        else:
-            # Update entire token data (for compatibility)
-            return jsonify({"status": "success", "message": "Tokens updated successfully"})
-            
-    except Exception as e:
-        logging.error(f"Error updating tokens: {e}")
-        db.session.rollback()
-        return jsonify({"status": "error", "message": str(e)}), 500
+    def generate():
+        try:
+            yield stream_greeting()
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                message = format_stream_event(event, locations)
+                if message:
+                    yield message
+        finally:
+            change_broker.unsubscribe(subscriber)
 
-# API Routes for Inventory
-@app.route('/api/inventory', methods=['GET'])
-def get_inventory():
-    """Get pharmacy inventory information"""
-    try:
-        items = InventoryItem.query.all()
-        medications = {}
-        supplies = {}
-        
-        for item in items:
-            item_dict = item.to_dict()
-            if item.item_type == 'medication':
-                medications[item.name] = item_dict
-            else:
-                supplies[item.name] = item_dict
-        
-        return jsonify({
-            "medications": medications,
-            "supplies": supplies,
-            "last_updated": datetime.utcnow().isoformat()
-        })
-    except Exception as e:
-        logging.error(f"Error getting inventory: {e}")
-        return jsonify({"error": str(e)}), 500
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
-@app.route('/api/inventory', methods=['POST'])
-def update_inventory():
-    """Update inventory information"""
-    try:
-        data = request.get_json()
-        
-        if 'item_name' in data:
-            # Update specific item
-            item_name = data['item_name']
-            quantity = data.get('quantity', 0)
-            operation = data.get('operation', 'set')
-            
-            item = InventoryItem.query.filter_by(name=item_name).first()
-            if item:
-                if operation == 'add':
-                    item.quantity += quantity
-                elif operation == 'subtract':
-                    item.quantity = max(0, item.quantity - quantity)
-                else:
-                    item.quantity = quantity
-                
-                item.updated_at = datetime.utcnow()
-                db.session.commit()
-                
-                return jsonify({"status": "success", "message": "Inventory updated successfully"})
-            else:
-                return jsonify({"status": "error", "message": "Item not found"}), 404
+# Read models served by the GET endpoints
+def token_state_query(department=None):
+    """Current tokens (one per department) and the waiting queue, in one query"""
+    query = db.session.query(*token_row.columns).filter(db.or_(
+        Token.is_current == True,
+        db.and_(Token.is_current == False, Token.status == 'waiting')
+    ))
+    if department:
+        query = query.filter(Token.department == department)
+    return query.order_by(Token.created_at)
+
+
+def build_token_state(department=None, cursor=None):
+    # Read the cursor first: anything committed meanwhile is re-sent, never skipped
+    if cursor is None:
+        _, cursor = token_log_bounds()
+
+    # Queue tokens get their estimated wait at the department's current pace
+    rates = service_rates.minutes_per_token()
+    current_tokens = {}
+    queue = {}
+    for token in token_row.all(token_state_query(department)):
+        if token['is_current']:
+            current_tokens[token['department']] = token['token_number']
+            continue
+        if token['department'] not in queue:
+            queue[token['department']] = []
+        rate = rates.get(token['department'])
+        token['estimated_wait_minutes'] = round(rate * (len(queue[token['department']]) + 1)) if rate is not None else None
+        queue[token['department']].append(token)
+
+    return {
+        "current_tokens": current_tokens,
+        "queue": queue,
+        "service_rates": rates,
+        "cursor": cursor,
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+def build_token_changes(since, department=None):
+    """Tokens inserted, updated or removed after the `since` cursor.
+
+    When the change log no longer reaches back that far, returns the full
+    state instead, marked "reset": true.
+    """
+    oldest, cursor = token_log_bounds()
+    if oldest is None or since < oldest - 1:
+        state = build_token_state(department, cursor=cursor)
+        state['reset'] = True
+        return state
+
+    # Each change with its token (None once removed), so no query per token
+    query = db.session.query(TokenChange.id, TokenChange.token_id, *token_row.columns) \
+        .outerjoin(Token, Token.id == TokenChange.token_id).filter(TokenChange.id > since)
+    if department:
+        query = query.filter(TokenChange.department == department)
+    rows = query.order_by(TokenChange.id).all()
+
+    token_ids = {token_id for _, token_id, *_ in rows}
+    # The token's columns follow the change's two, all None once it was removed
+    tokens = {row[2]: row[2:] for row in rows if row[2] is not None}
+    return {
+        "changes": token_row.all(tokens.values()),
+        "removed": sorted(token_ids - tokens.keys()),
+        "service_rates": service_rates.minutes_per_token(),
+        # Never behind the caller's own cursor, or it would fetch the same changes again
+        "cursor": max(since, cursor),
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+def build_inventory_state():
+    items = inventory_row.all(db.session.query(*inventory_row.columns))
+    medications = {}
+    supplies = {}
+
+    for item in items:
+        if item['item_type'] == 'medication':
+            medications[item['name']] = item
         else:
-            return jsonify({"status": "success", "message": "Inventory updated successfully"})
-            
-    except Exception as e:
-        logging.error(f"Error updating inventory: {e}")
-        db.session.rollback()
-        return jsonify({"status": "error", "message": str(e)}), 500
+            supplies[item['name']] = item
 
-# API Routes for Alerts
-@app.route('/api/alerts', methods=['GET'])
-def get_alerts():
-    """Get current alerts"""
-    try:
-        active_alerts = Alert.query.filter_by(is_active=True).order_by(Alert.created_at.desc()).all()
-        alert_history = Alert.query.filter_by(is_active=False).order_by(Alert.dismissed_at.desc()).limit(10).all()
-        
-        return jsonify({
-            "active_alerts": [alert.to_dict() for alert in active_alerts],
-            "alert_history": [alert.to_dict() for alert in alert_history],
-            "last_updated": datetime.utcnow().isoformat()
-        })
-    except Exception as e:
-        logging.error(f"Error getting alerts: {e}")
-        return jsonify({"error": str(e)}), 500
+    return {
+        "medications": medications,
+        "supplies": supplies,
+        "last_updated": datetime.utcnow().isoformat()
+    }
 
-@app.route('/api/alerts', methods=['POST'])
-def create_alert():
-    """Create new emergency alert"""
-    try:
-        data = request.get_json()
-        
-        new_alert = Alert(
+
+def build_low_stock_state(limit, offset):
+    margin = InventoryItem.quantity - InventoryItem.min_threshold
+    query = db.session.query(*inventory_row.columns).filter(margin <= 0)
+    total = query.count()
+    items = inventory_row.all(query.order_by(margin, InventoryItem.id).offset(offset).limit(limit))
+    return paginated_items(items, total, limit, offset)
+
+
+def build_expiring_state(today, days, limit, offset):
+    query = db.session.query(*inventory_row.columns).filter(InventoryItem.expiry_date <= today + timedelta(days=days))
+    total = query.count()
+    items = inventory_row.all(query.order_by(InventoryItem.expiry_date, InventoryItem.id).offset(offset).limit(limit))
+
+    state = paginated_items(items, total, limit, offset)
+    for item in state['items']:
+        item['days_to_expiry'] = (date.fromisoformat(item['expiry_date']) - today).days
+    return state
+
+
+def paginated_items(items, total, limit, offset):
+    return {
+        "items": items,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + len(items) if offset + len(items) < total else None,
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+def build_alert_state(locations=frozenset()):
+    # Served from memory; dismissed alerts are paged by /api/alerts/history
+    return {
+        "active_alerts": [alert for alert in active_alerts.active() if alert_targets(alert, locations)],
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+# Display names for the departments on the wards' signage; others are capitalised
+DEPARTMENT_NAMES = {
+    'general': 'General Medicine',
+    'cardiology': 'Cardiology',
+    'orthopedics': 'Orthopedics',
+    'pediatrics': 'Pediatrics',
+    'gynecology': 'Gynecology',
+    'surgery': 'Surgery',
+    'ent': 'ENT',
+    'dermatology': 'Dermatology',
+    'ophthalmology': 'Ophthalmology',
+    'psychiatry': 'Psychiatry'
+}
+
+ALERT_STYLES = {
+    # type: (css class, title)
+    'code_blue': ('code-blue', 'MEDICAL EMERGENCY'),
+    'code_red': ('code-red', 'FIRE EMERGENCY'),
+    'general': ('general', 'HOSPITAL NOTICE'),
+    'emergency': ('code-red', 'EMERGENCY ALERT'),
+    'maintenance': ('general', 'MAINTENANCE NOTICE')
+}
+DISPLAY_QUEUE_LENGTH = 10
+DISPLAY_TIMEZONE = ZoneInfo('Asia/Kolkata')
+
+
+@app.template_filter('display_time')
+def display_time(value):
+    """Format a stored UTC timestamp as wall-clock time on the hospital's displays"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=timezone.utc).astimezone(DISPLAY_TIMEZONE).strftime('%I:%M %p')
+
+
+def hospital_today():
+    """Today's date on the hospital's displays, the day that queues roll over on"""
+    return datetime.now(DISPLAY_TIMEZONE).date()
+
+
+def day_start(day):
+    """Midnight starting `day` on the displays, as the naive UTC timestamp the tables store"""
+    return datetime.combine(day, time.min, DISPLAY_TIMEZONE).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def build_department_display(department):
+    current_token = Token.query.filter_by(department=department, is_current=True).first()
+    queue_query = Token.query.filter_by(department=department, is_current=False, status='waiting')
+    waiting = queue_query.order_by(Token.created_at).limit(DISPLAY_QUEUE_LENGTH).all()
+    waiting_count = queue_query.count()
+
+    locations = display_locations(department)
+    alerts = [alert for alert in active_alerts.active()
+              if alert['type'] not in STAFF_ALERT_TYPES and alert_targets(alert, locations)]
+
+    return {
+        "department_name": DEPARTMENT_NAMES.get(department.lower(), department.capitalize()),
+        "current_token": current_token.token_number if current_token else None,
+        "waiting": waiting,
+        "more_waiting": waiting_count - len(waiting),
+        "alerts": [(alert, *ALERT_STYLES.get(alert['type'], ('general', 'NOTICE'))) for alert in alerts],
+        "last_updated": datetime.utcnow()
+    }
+
+
+def build_schedule_state(day):
+    # Served from the in-memory day view; other dates and filters go through build_schedule_range
+    ot_schedules = {}
+    consultations = {}
+
+    for schedule in schedule_days.day(day):
+        key = f"{day}_{schedule['schedule_type']}_{schedule['id']}"
+
+        if schedule['schedule_type'] == 'ot':
+            ot_schedules[key] = schedule
+        else:
+            consultations[key] = schedule
+
+    return {
+        "date": day.isoformat(),
+        "ot_schedules": ot_schedules,
+        "consultations": consultations,
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+def build_schedule_range(start, end, schedule_type=None, department=None, room=None, doctor=None):
+    query = db.session.query(*schedule_row.columns).filter(Schedule.schedule_date.between(start, end))
+    if schedule_type:
+        query = query.filter(Schedule.schedule_type == schedule_type)
+    if department:
+        query = query.filter(db.func.lower(Schedule.department) == department.lower())
+    if room:
+        query = query.filter(db.func.lower(Schedule.room_number) == room.lower())
+    if doctor:
+        # Surgeons and anesthesiologists are both on an OT booking
+        pattern = f"%{doctor}%"
+        query = query.filter(db.or_(Schedule.doctor_name.ilike(pattern), Schedule.anesthesiologist.ilike(pattern)))
+    schedules = schedule_row.all(
+        query.order_by(Schedule.schedule_date, Schedule.schedule_type, Schedule.start_time, Schedule.id))
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "schedules": schedules,
+        "total": len(schedules),
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+# Schedule conflict detection
+SCHEDULE_FREE_STATUSES = ('cancelled',)  # bookings that no longer hold their room or clinicians
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def schedule_resources(schedule):
+    """(resource key, display name) for the room and each clinician a booking holds on its date"""
+    resources = {}
+    if normalize_name(schedule.room_number):
+        resources[('room', normalize_name(schedule.room_number), schedule.schedule_date)] = schedule.room_number
+    for name in (schedule.doctor_name, schedule.anesthesiologist):
+        if normalize_name(name):
+            resources.setdefault(('clinician', normalize_name(name), schedule.schedule_date), name)
+    return resources.items()
+
+
+class ScheduleIntervals:
+    """Bookings per room and per clinician per day, sorted by start time.
+
+    A booking can only overlap those starting before it ends and after its
+    start minus the longest booking held on that resource, so finding them
+    takes two binary searches rather than a scan of the day.
+    """
+
+    def __init__(self):
+        self._starts = {}  # resource -> sorted start minutes
+        self._bookings = {}  # resource -> (start, end, schedule), in the same order
+        self._longest = {}
+
+    def overlapping(self, schedule):
+        """(resource name, booking) for every stored booking the schedule overlaps"""
+        start, end = minutes(schedule.start_time), minutes(schedule.end_time)
+        found = []
+        for resource, name in schedule_resources(schedule):
+            starts = self._starts.get(resource)
+            if not starts:
+                continue
+            low = bisect_right(starts, start - self._longest[resource])
+            high = bisect_left(starts, end)
+            found.extend((resource[0], name, other) for _, other_end, other in self._bookings[resource][low:high]
+                         if other_end > start)
+        return found
+
+    def add(self, schedule):
+        start, end = minutes(schedule.start_time), minutes(schedule.end_time)
+        for resource, _ in schedule_resources(schedule):
+            starts = self._starts.setdefault(resource, [])
+            position = bisect_right(starts, start)
+            starts.insert(position, start)
+            self._bookings.setdefault(resource, []).insert(position, (start, end, schedule))
+            self._longest[resource] = max(self._longest.get(resource, 0), end - start)
+
+
+def booking_summary(schedule):
+    return {
+        'id': schedule.id,
+        'schedule_type': schedule.schedule_type,
+        'procedure': schedule.procedure_name,
+        'doctor': schedule.doctor_name,
+        'anesthesiologist': schedule.anesthesiologist,
+        'room': schedule.room_number,
+        'start_time': schedule.start_time.strftime('%H:%M'),
+        'end_time': schedule.end_time.strftime('%H:%M')
+    }
+
+
+def find_overlaps(intervals, schedules, rows=None):
+    """Check each schedule against those already indexed and index it, in order.
+
+    With `rows` (schedule -> its 1-based row in a submitted batch), each side
+    of a conflict also carries its "row", None for stored schedules, since
+    new schedules have no id yet.
+    """
+    conflicts = []
+    for schedule in schedules:
+        for kind, name, other in intervals.overlapping(schedule):
+            conflict = {
+                "resource": kind,
+                "name": name,
+                "date": schedule.schedule_date.isoformat(),
+                "schedule": booking_summary(schedule),
+                "conflicts_with": booking_summary(other)
+            }
+            if rows is not None:
+                conflict["schedule"]["row"] = rows.get(schedule)
+                conflict["conflicts_with"]["row"] = rows.get(other)
+            conflicts.append(conflict)
+        intervals.add(schedule)
+    return conflicts
+
+
+def holding_schedules():
+    """Bookings that still hold their room and clinicians"""
+    return Schedule.query.filter(db.or_(Schedule.status.is_(None), Schedule.status.notin_(SCHEDULE_FREE_STATUSES)))
+
+
+def schedule_conflicts(schedules, replaced_ids=()):
+    """Double bookings the given schedules would create, among themselves or with stored ones.
+
+    Stored schedules in replaced_ids are left out, as the given ones replace them.
+    """
+    rows = {schedule: number for number, schedule in enumerate(schedules, start=1)}
+    schedules = [schedule for schedule in schedules if schedule.status not in SCHEDULE_FREE_STATUSES]
+    dates = {schedule.schedule_date for schedule in schedules}
+    if not dates:
+        return []
+
+    intervals = ScheduleIntervals()
+    stored = holding_schedules().filter(Schedule.schedule_date.in_(dates))
+    if replaced_ids:
+        stored = stored.filter(Schedule.id.notin_(replaced_ids))
+    for schedule in stored:
+        intervals.add(schedule)
+    return find_overlaps(intervals, schedules, rows)
+
+
+def build_schedule_conflicts(start, end):
+    schedules = holding_schedules().filter(Schedule.schedule_date.between(start, end)).order_by(
+        Schedule.schedule_date, Schedule.start_time, Schedule.id
+    ).all()
+    conflicts = find_overlaps(ScheduleIntervals(), schedules)
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "conflicts": conflicts,
+        "total": len(conflicts),
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+# Token queue operations
+BULK_TOKEN_LIMIT = 10000
+TOKEN_CURSOR_SETTLE_SECONDS = 2
+
+
+def log_token_changes(tokens):
+    """Append (token id, department) pairs to the change log inside the caller's transaction"""
+    rows = [{'token_id': token_id, 'department': department} for token_id, department in tokens]
+    if rows:
+        db.session.execute(db.insert(TokenChange), rows)
+
+
+def latest_token_cursor():
+    return db.session.query(db.func.max(TokenChange.id)).scalar() or 0
+
+
+def token_log_bounds():
+    """The oldest change id still in the log, and the cursor to hand out with a read.
+
+    A change inside the settle window may have siblings with lower ids whose
+    transactions haven't committed yet, so the cursor stops just before the
+    oldest such change rather than at the newest id.
+    """
+    settle_cutoff = datetime.utcnow() - timedelta(seconds=TOKEN_CURSOR_SETTLE_SECONDS)
+    # Separate subqueries, since SQLite only reads min() or max() straight off an index on its own
+    oldest, latest, unsettled = db.session.query(
+        db.select(db.func.min(TokenChange.id)).scalar_subquery(),
+        db.select(db.func.max(TokenChange.id)).scalar_subquery(),
+        # id + 0 keeps SQLite on the changed_at index instead of walking the log from its first id
+        db.select(db.func.min(TokenChange.id + 0)).where(TokenChange.changed_at > settle_cutoff).scalar_subquery()
+    ).one()
+    cursor = unsettled - 1 if unsettled is not None else latest or 0
+    return oldest, cursor
+
+
+def lock_department_queue(department):
+    """Serialize queue changes for one department until the current transaction ends"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        db.session.execute(db.text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                           {"key": f"token_queue:{department}"})
+    elif dialect == 'sqlite':
+        # SQLite has no row locks; take the database write lock before reading
+        db.session.execute(db.text("BEGIN IMMEDIATE"))
+
+
+# Token number prefixes for the departments on the wards' signage; others use their initial
+TOKEN_PREFIXES = {
+    'general': 'G',
+    'cardiology': 'C',
+    'orthopedics': 'O',
+    'pediatrics': 'P',
+    'gynecology': 'GY',
+    'surgery': 'S',
+}
+
+
+def highest_token_number(department, prefix, since=None):
+    """Highest numeric suffix among the department's live tokens, to seed a new counter"""
+    query = db.session.query(Token.token_number).filter(
+        Token.department == department, Token.token_number.startswith(prefix)
+    )
+    if since:
+        query = query.filter(Token.created_at >= day_start(since))
+    highest = 0
+    for (token_number,) in query:
+        suffix = token_number[len(prefix):]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+def get_token_counter(department):
+    """The department's counter row, created on first use without racing other workers"""
+    counter = db.session.get(TokenCounter, department)
+    if counter:
+        return counter
+
+    today = hospital_today()
+    prefix = TOKEN_PREFIXES.get(department.lower(), department[:1].upper())
+    # Read before the savepoint: on SQLite a read inside it would hold a shared
+    # lock that deadlocks against another first-time issuer
+    last_number = highest_token_number(department, prefix, since=today)
+    try:
+        with db.session.begin_nested():
+            counter = TokenCounter(department=department, prefix=prefix, counter_date=today,
+                                   last_number=last_number)
+            db.session.add(counter)
+    except IntegrityError:
+        # Another request created it first
+        counter = db.session.get(TokenCounter, department)
+    return counter
+
+
+def allocate_token_numbers(department, count=1):
+    """Reserve the next `count` token numbers for a department with one atomic UPDATE.
+
+    The counter row stays locked until the caller commits, so numbers are never
+    handed out twice, and a rollback returns them. With daily_reset the sequence
+    restarts at 1 on the first issue of each day on the displays.
+    """
+    get_token_counter(department)
+    today = hospital_today()
+    continues = db.or_(TokenCounter.counter_date == today, db.not_(TokenCounter.daily_reset))
+    last_number, prefix = db.session.execute(
+        db.update(TokenCounter)
+        .where(TokenCounter.department == department)
+        .values(last_number=db.case((continues, TokenCounter.last_number + count), else_=count),
+                counter_date=today)
+        .returning(TokenCounter.last_number, TokenCounter.prefix)
+        .execution_options(synchronize_session=False)
+    ).one()
+    return [f"{prefix}{number:03d}" for number in range(last_number - count + 1, last_number + 1)]
+
+
+class DuplicateToken(ValueError):
+    pass
+
+
+def claim_token_numbers(rows):
+    """Reserve caller-supplied token numbers against their departments' counters.
+
+    Moves each counter up to the highest number claimed, so the numbers it
+    hands out later never repeat one, and raises DuplicateToken when a number
+    is already held by a waiting or current token. The counters stay locked
+    until the caller commits, as with allocate_token_numbers().
+    """
+    numbers = {}
+    for row in rows:
+        if not isinstance(row['token_number'], str):
+            raise ValueError("token_number must be a string")
+        numbers.setdefault(row['department'], []).append(row['token_number'])
+    for department, token_numbers in numbers.items():
+        if len(set(token_numbers)) < len(token_numbers):
+            raise DuplicateToken(f"The batch repeats a token number for {department}")
+
+    counters = {}
+    if len(numbers) > 1:
+        # One read for the existing counters, so only new ones cost get_token_counter's queries
+        counters = {counter.department: counter for counter in
+                    db.session.scalars(db.select(TokenCounter).where(TokenCounter.department.in_(numbers)))}
+    highest = {}
+    for department, token_numbers in numbers.items():
+        prefix = (counters.get(department) or get_token_counter(department)).prefix
+        suffixes = [number[len(prefix):] for number in token_numbers if number.startswith(prefix)]
+        highest[department] = max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+
+    today = hospital_today()
+    continues = db.or_(TokenCounter.counter_date == today, db.not_(TokenCounter.daily_reset))
+    current = db.case((continues, TokenCounter.last_number), else_=0)
+    claimed = db.case(highest, value=TokenCounter.department)
+    db.session.execute(
+        db.update(TokenCounter)
+        .where(TokenCounter.department.in_(numbers))
+        .values(last_number=db.case((current < claimed, claimed), else_=current), counter_date=today)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Checked under the counter locks, so a concurrent claim of the same number has committed or waits
+    held = db.session.execute(db.select(Token.department, Token.token_number).where(
+        Token.department.in_(numbers),
+        Token.token_number.in_([number for token_numbers in numbers.values() for number in token_numbers]),
+        db.or_(Token.is_current == True, Token.status == 'waiting')
+    )).all()
+    taken = sorted(number for department, number in held if number in numbers[department])
+    if taken:
+        raise DuplicateToken(f"Token number(s) already in the queue: {', '.join(taken)}")
+
+
+def issue_tokens(rows):
+    """Insert waiting tokens with one multi-row INSERT and commit; returns their dicts"""
+    tokens = db.session.scalars(db.insert(Token).returning(Token), [
+        {
+            'department': row['department'],
+            'token_number': row['token_number'],
+            'patient_type': row.get('patient_type') or 'General',
+            'status': 'waiting',
+            'is_current': False
+        }
+        for row in rows
+    ]).all()
+    log_token_changes((token.id, token.department) for token in tokens)
+    # Serialize before commit expires the objects
+    issued = [token.to_dict() for token in tokens]
+    db.session.commit()
+    return issued
+
+
+def advance_department_queue(department):
+    """Complete the current token and promote the next waiting one in a single transaction.
+
+    Returns (completed_token, next_token, consultation), any of which may be
+    None; consultation is the session the completed token was counted against.
+    """
+    lock_department_queue(department)
+
+    current_token = Token.query.filter_by(department=department, is_current=True).with_for_update().first()
+    consultation = None
+    if current_token:
+        current_token.is_current = False
+        current_token.status = 'completed'
+        consultation = record_consultation_progress(department)
+        # Free the department's "current" slot before promoting the next token
+        db.session.flush()
+
+    next_token = Token.query.filter_by(
+        department=department,
+        is_current=False,
+        status='waiting'
+    ).order_by(Token.created_at).with_for_update(skip_locked=True).first()
+    if next_token:
+        next_token.is_current = True
+        next_token.status = 'in_progress'
+
+    db.session.flush()
+    log_token_changes((token.id, token.department) for token in (current_token, next_token) if token)
+    db.session.commit()
+    return current_token, next_token, consultation
+
+
+def record_consultation_progress(department):
+    """Count a completed token against the department's consultation session running now"""
+    now = datetime.now()
+    names = {department.lower(), DEPARTMENT_NAMES.get(department.lower(), department).lower()}
+    consultation = holding_schedules().filter(
+        Schedule.schedule_date == now.date(),
+        Schedule.schedule_type == 'consultation',
+        db.func.lower(Schedule.department).in_(names),
+        Schedule.start_time <= now.time(),
+        Schedule.end_time > now.time()
+    ).order_by(Schedule.start_time).with_for_update().first()
+    if consultation:
+        consultation.completed_appointments = (consultation.completed_appointments or 0) + 1
+        # Walk-ins beyond the booked appointments still leave nothing remaining
+        consultation.total_appointments = max(consultation.total_appointments or 0, consultation.completed_appointments)
+        if consultation.status == 'scheduled':
+            consultation.status = 'ongoing'
+    return consultation
+
+
+ARCHIVED_TOKEN_COLUMNS = ('department', 'token_number', 'patient_type', 'status', 'created_at', 'updated_at')
+
+
+def archive_tokens(before=None, batch_size=5000):
+    """Move completed tokens, and anything left over from before `before`, into token_history.
+
+    `before` is a date on the hospital's displays and defaults to today there.
+
+    Runs in batches so the live queue is never locked for long. Returns the
+    number of tokens archived.
+    """
+    cutoff = day_start(before or hospital_today())
+    started = datetime.utcnow()
+    archivable = db.or_(Token.status == 'completed', Token.created_at < cutoff)
+    archived = 0
+
+    while True:
+        if db.session.get_bind().dialect.name == 'sqlite':
+            db.session.execute(db.text("BEGIN IMMEDIATE"))
+        tokens = Token.query.filter(archivable).order_by(Token.id).limit(batch_size) \
+            .with_for_update(skip_locked=True).all()
+        if not tokens:
+            # Cursors older than the cutoff will get a full reload instead. The
+            # newest entry always stays so a fresh cursor still matches the log.
+            db.session.execute(db.delete(TokenChange).where(
+                TokenChange.changed_at < min(cutoff, started), TokenChange.id < latest_token_cursor()
+            ))
+            db.session.commit()
+            return archived
+
+        ids = [token.id for token in tokens]
+        # Tokens still on a display (yesterday's queue) must disappear from it
+        leftovers = [token.to_dict() for token in tokens if token.status != 'completed']
+        log_token_changes((change['id'], change['department']) for change in leftovers)
+        db.session.execute(db.insert(TokenHistory).from_select(
+            ('token_id',) + ARCHIVED_TOKEN_COLUMNS,
+            db.select(Token.id, *(getattr(Token, column) for column in ARCHIVED_TOKEN_COLUMNS))
+            .where(Token.id.in_(ids))
+        ))
+        db.session.execute(db.delete(Token).where(Token.id.in_(ids)))
+        db.session.commit()
+        archived += len(ids)
+
+        if leftovers:
+            for change in leftovers:
+                change.update(status='archived', is_current=False)
+            notify_change('tokens', leftovers)
+
+# API Routes for Tokens
+@app.route('/api/tokens', methods=['GET'])
+@query_budget(2)
+def get_tokens():
+    """Get current token information, optionally for one department or as changes since a cursor"""
+    try:
+        department = request.args.get('department') or None
+        since = request.args.get('since')
+
+        if since is not None:
+            return jsonify(build_token_changes(int(since), department))
+
+        # tokens:all is shared with /api/snapshot
+        return cached_json_response('tokens', lambda: build_token_state(department), key=f"tokens:{department or 'all'}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting tokens: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/tokens', methods=['POST'])
+# A department's first token also creates its counter (get, highest number, savepoint, insert,
+# release), a supplied number is checked against the queue, a racing worker adds a re-read,
+# and PostgreSQL a NOTIFY
+@query_budget(11)
+def update_tokens():
+    """Update token information"""
+    try:
+        data = request.get_json()
+        
+        if 'department' in data:
+            # Add new token to queue, numbered by the server unless the caller supplies one
+            token_number = data.get('token_number')
+            if token_number:
+                claim_token_numbers([{'department': data['department'], 'token_number': token_number}])
+            else:
+                token_number = allocate_token_numbers(data['department'])[0]
+            new_token = Token(
+                department=data['department'],
+                token_number=token_number,
+                patient_type=data.get('patient_type', 'General'),
+                status='waiting',
+                is_current=False
+            )
+            db.session.add(new_token)
+            db.session.flush()
+            log_token_changes([(new_token.id, new_token.department)])
+            # Serialized before commit, which would expire it and cost a re-read
+            token = new_token.to_dict()
+            db.session.commit()
+            notify_change('tokens', [token])
+            
+            return jsonify({"status": "success", "message": f"Token {token_number} added successfully", "token": token})
+        else:
+            # Update entire token data (for compatibility)
+            return jsonify({"status": "success", "message": "Tokens updated successfully"})
+            
+    except DuplicateToken as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error updating tokens: {e}")
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/tokens/bulk', methods=['POST'])
+# As POST /api/tokens, plus one read of the counters when supplied numbers span departments.
+# Each department getting its first counter adds 4, so this allows for one per batch
+@query_budget(12)
+def bulk_issue_tokens():
+    """Issue a batch of tokens in a single transaction.
+
+    Accepts either {"tokens": [{"department", "token_number", "patient_type"}, ...]}
+    or {"department", "count", "patient_type"} for server-side numbering.
+    """
+    try:
+        data = request.get_json() or {}
+
+        size_error = f"A batch must hold 1 to {BULK_TOKEN_LIMIT} tokens"
+
+        if 'tokens' in data:
+            rows = data['tokens']
+            if not isinstance(rows, list) or not 1 <= len(rows) <= BULK_TOKEN_LIMIT:
+                return jsonify({"status": "error", "message": size_error}), 400
+            if any(not isinstance(row, dict) or not row.get('department') or not row.get('token_number') for row in rows):
+                return jsonify({"status": "error", "message": "Each token needs a department and token_number"}), 400
+            claim_token_numbers(rows)
+        elif data.get('department') and 'count' in data:
+            count = data['count']
+            if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= BULK_TOKEN_LIMIT:
+                return jsonify({"status": "error", "message": size_error}), 400
+            rows = [
+                {'department': data['department'], 'token_number': token_number,
+                 'patient_type': data.get('patient_type')}
+                for token_number in allocate_token_numbers(data['department'], count)
+            ]
+        else:
+            return jsonify({"status": "error", "message": "Provide tokens, or department and count"}), 400
+
+        issued = issue_tokens(rows)
+        notify_change('tokens', issued)
+
+        return jsonify({
+            "status": "success",
+            "message": f"{len(issued)} tokens added successfully",
+            "tokens": [{"id": token['id'], "department": token['department'],
+                        "token_number": token['token_number']} for token in issued]
+        })
+
+    except DuplicateToken as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error issuing tokens: {e}")
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/tokens/counters', methods=['GET'])
+@query_budget(1)
+def get_token_counters():
+    """Get token numbering settings per department"""
+    try:
+        counters = TokenCounter.query.order_by(TokenCounter.department).all()
+        return jsonify({"counters": [counter.to_dict() for counter in counters]})
+    except Exception as e:
+        logging.error(f"Error getting token counters: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/tokens/counters/<department>', methods=['POST'])
+# Creating the counter runs 6 statements (get, highest number, savepoint, insert, release, update)
+# and a racing worker adds a re-read
+@query_budget(7)
+def update_token_counter(department):
+    """Configure a department's token prefix and daily reset"""
+    try:
+        data = request.get_json() or {}
+        last_number = data.get('last_number')
+        if 'last_number' in data and (not isinstance(last_number, int) or isinstance(last_number, bool)
+                                      or last_number < 0):
+            return jsonify({"status": "error", "message": "last_number must be a whole number of 0 or more"}), 400
+        counter = get_token_counter(department)
+
+        if 'prefix' in data:
+            prefix = str(data['prefix']).strip().upper()
+            if not prefix or len(prefix) > 10:
+                return jsonify({"status": "error", "message": "prefix must be 1 to 10 characters"}), 400
+            counter.prefix = prefix
+        if 'daily_reset' in data:
+            counter.daily_reset = bool(data['daily_reset'])
+        if 'last_number' in data:
+            counter.last_number = last_number
+            counter.counter_date = hospital_today()
+
+        db.session.commit()
+        return jsonify({"status": "success", "message": "Token counter updated successfully",
+                        "counter": counter.to_dict()})
+    except Exception as e:
+        logging.error(f"Error updating token counter: {e}")
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/tokens/history', methods=['GET'])
+@query_budget(1)
+def get_token_history():
+    """Get archived tokens for reporting"""
+    try:
+        query = TokenHistory.query
+        if request.args.get('department'):
+            query = query.filter(TokenHistory.department == request.args['department'])
+        if request.args.get('from'):
+            query = query.filter(TokenHistory.created_at >= date.fromisoformat(request.args['from']))
+        if request.args.get('to'):
+            end = datetime.combine(date.fromisoformat(request.args['to']), time.max)
+            query = query.filter(TokenHistory.created_at <= end)
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+
+        tokens = query.order_by(TokenHistory.created_at.desc()).limit(limit).all()
+        return jsonify({
+            "tokens": [token.to_dict() for token in tokens],
+            "count": len(tokens)
+        })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting token history: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Inventory operations
+STOCK_OPERATIONS = ('add', 'subtract', 'set')
+BATCH_STOCK_LIMIT = 10000
+
+
+class InsufficientStock(ValueError):
+    pass
+
+
+def begin_stock_transaction():
+    """Take SQLite's write lock up front; PostgreSQL locks the item rows as they are updated"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        db.session.execute(db.text("BEGIN IMMEDIATE"))
+
+
+def validate_stock_change(operation, quantity):
+    if operation not in STOCK_OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}'")
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+        raise ValueError("Quantity must be a non-negative integer")
+
+
+def move_stock(item_name, operation, quantity, actor=None, note=None):
+    """Apply one stock change with an atomic UPDATE and record it in the ledger.
+
+    Runs in the caller's transaction. Raises LookupError for an unknown item,
+    InsufficientStock if it would take stock below zero and ValueError for an
+    invalid change.
+    """
+    validate_stock_change(operation, quantity)
+
+    statement = db.update(InventoryItem).where(InventoryItem.name == item_name)
+    if operation == 'add':
+        statement = statement.values(quantity=InventoryItem.quantity + quantity)
+    elif operation == 'subtract':
+        statement = statement.where(InventoryItem.quantity >= quantity) \
+            .values(quantity=InventoryItem.quantity - quantity)
+    else:
+        # The change recorded for a stock count is relative to the locked current level
+        previous = db.session.execute(
+            db.select(InventoryItem.quantity).where(InventoryItem.name == item_name).with_for_update()
+        ).scalar()
+        statement = statement.values(quantity=quantity)
+
+    row = db.session.execute(
+        statement.values(updated_at=datetime.utcnow()).returning(InventoryItem.id, InventoryItem.quantity),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if row is None:
+        if db.session.query(InventoryItem.id).filter_by(name=item_name).first() is None:
+            raise LookupError(f"Item '{item_name}' not found")
+        raise InsufficientStock(f"Insufficient stock of '{item_name}' to remove {quantity}")
+
+    item_id, quantity_after = row
+    change = {'add': quantity, 'subtract': -quantity}.get(operation)
+    if change is None:
+        change = quantity_after - previous
+    db.session.execute(db.insert(StockMovement).values(
+        item_id=item_id, operation=operation, change=change, quantity_after=quantity_after,
+        actor=actor, note=note
+    ))
+    return item_id
+
+
+def move_stock_batch(changes, actor=None):
+    """Apply a list of {item, operation, quantity[, note]} changes in the caller's transaction.
+
+    Locks every item involved with one SELECT, applies the changes in order in
+    memory, then writes all new quantities with one bulk UPDATE and all ledger
+    rows with one INSERT. A change that is invalid, names an unknown item or
+    would take stock below zero is skipped. Returns a result per change and the
+    ids of the items that changed.
+    """
+    names = {change['item'] for change in changes if isinstance(change, dict) and isinstance(change.get('item'), str)}
+    items = {
+        name: {'id': item_id, 'quantity': quantity}
+        for item_id, name, quantity in db.session.execute(
+            db.select(InventoryItem.id, InventoryItem.name, InventoryItem.quantity)
+            .where(InventoryItem.name.in_(names)).with_for_update()
+        )
+    }
+
+    results = []
+    movements = []
+    for change in changes:
+        if not isinstance(change, dict) or not isinstance(change.get('item'), str):
+            results.append({'item': None, 'status': 'error', 'message': "Each change needs an item name"})
+            continue
+        name, operation, quantity = change.get('item'), change.get('operation', 'set'), change.get('quantity', 0)
+        try:
+            validate_stock_change(operation, quantity)
+        except ValueError as e:
+            results.append({'item': name, 'status': 'error', 'message': str(e)})
+            continue
+        item = items.get(name)
+        if item is None:
+            results.append({'item': name, 'status': 'not_found', 'message': f"Item '{name}' not found"})
+            continue
+        if operation == 'subtract' and item['quantity'] < quantity:
+            results.append({'item': name, 'status': 'insufficient',
+                            'message': f"Insufficient stock of '{name}' to remove {quantity}",
+                            'quantity': item['quantity']})
+            continue
+
+        new_quantity = {'add': item['quantity'] + quantity, 'subtract': item['quantity'] - quantity}.get(operation, quantity)
+        movements.append({'item_id': item['id'], 'operation': operation, 'change': new_quantity - item['quantity'],
+                          'quantity_after': new_quantity, 'actor': actor, 'note': change.get('note')})
+        item['quantity'] = new_quantity
+        results.append({'item': name, 'status': 'success', 'quantity': new_quantity})
+
+    changed = {movement['item_id'] for movement in movements}
+    if movements:
+        now = datetime.utcnow()
+        db.session.execute(db.update(InventoryItem), [
+            {'id': item['id'], 'quantity': item['quantity'], 'updated_at': now}
+            for item in items.values() if item['id'] in changed
+        ])
+        db.session.execute(db.insert(StockMovement), movements)
+    return results, changed
+
+
+def record_opening_stock():
+    """Give every item without ledger entries an opening movement for its current quantity.
+
+    Returns the number of items recorded.
+    """
+    unrecorded = db.select(InventoryItem.id, db.literal('opening'), InventoryItem.quantity, InventoryItem.quantity) \
+        .where(~db.exists().where(StockMovement.item_id == InventoryItem.id))
+    result = db.session.execute(db.insert(StockMovement).from_select(
+        ('item_id', 'operation', 'change', 'quantity_after'), unrecorded
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+def rebuild_stock_levels():
+    """Recompute every item's quantity from the ledger.
+
+    Returns the {name: (stored, ledger)} pairs that disagreed before the rebuild.
+    """
+    begin_stock_transaction()
+    totals = db.select(StockMovement.item_id, db.func.sum(StockMovement.change).label('total')) \
+        .group_by(StockMovement.item_id).subquery()
+    rows = db.session.execute(
+        db.select(InventoryItem.id, InventoryItem.name, InventoryItem.quantity, db.func.coalesce(totals.c.total, 0))
+        .outerjoin(totals, totals.c.item_id == InventoryItem.id).with_for_update(of=InventoryItem)
+    ).all()
+
+    drift = {name: (stored, total) for _, name, stored, total in rows if stored != total}
+    if drift:
+        db.session.execute(db.update(InventoryItem), [
+            {'id': item_id, 'quantity': total} for item_id, _, stored, total in rows if stored != total
+        ])
+    db.session.commit()
+    return drift
+
+# Automatic stock alerts
+STOCK_ALERT_TYPES = ('low_stock', 'expiring_stock')
+STAFF_ALERT_TYPES = ('staff_only',) + STOCK_ALERT_TYPES  # kept off patient displays
+STOCK_ALERT_LOCATION = 'Pharmacy'
+EXPIRY_WARNING_DAYS = 30
+STOCK_ALERT_SCAN_SECONDS = 3600  # how often the worker checks for a new day's expiry window
+STOCK_ALERT_RETRY_SECONDS = 1  # wait before retrying a failed pass, doubling each time it fails again
+STOCK_ALERT_MAX_RETRY_SECONDS = 60
+
+
+def stock_alert_conditions(item, today):
+    """(alert type, whether it is due, message) for each stock condition of an item"""
+    low = item.quantity is not None and item.quantity <= (item.min_threshold or 0)
+    expiring = item.expiry_date is not None and item.expiry_date <= today + timedelta(days=EXPIRY_WARNING_DAYS)
+    if item.expiry_date is not None and item.expiry_date < today:
+        expiry_message = f"{item.name} expired on {item.expiry_date.isoformat()}"
+    else:
+        expiry_message = f"{item.name} expires on {item.expiry_date.isoformat() if item.expiry_date else '-'}"
+    return [
+        ('low_stock', low,
+         f"Low stock: {item.name} at {item.quantity} {item.unit} (minimum {item.min_threshold})"),
+        ('expiring_stock', expiring, expiry_message),
+    ]
+
+
+def sync_stock_alerts(item_ids):
+    """Raise, update or resolve the stock alerts of the given items.
+
+    Returns the alerts that changed.
+    """
+    today = date.today()
+    items = InventoryItem.query.filter(InventoryItem.id.in_(item_ids)).all()
+    keys = [f"{alert_type}:{item.id}" for item in items for alert_type in STOCK_ALERT_TYPES]
+    active = {alert.source_key: alert for alert in
+              Alert.query.filter(Alert.is_active == True, Alert.source_key.in_(keys)).all()}
+
+    changed = []
+    for item in items:
+        for alert_type, due, message in stock_alert_conditions(item, today):
+            key = f"{alert_type}:{item.id}"
+            alert = active.get(key)
+            if due and alert is None:
+                alert = Alert(alert_type=alert_type, message=message, location=STOCK_ALERT_LOCATION,
+                              is_active=True, created_by='System', source_key=key)
+                db.session.add(alert)
+                changed.append(alert)
+            elif due and alert.message != message:
+                alert.message = message
+                changed.append(alert)
+            elif not due and alert is not None:
+                alert.is_active = False
+                alert.dismissed_at = datetime.utcnow()
+                changed.append(alert)
+
+    db.session.commit()
+    return changed
+
+
+class StockAlertWorker:
+    """Background thread that keeps stock alerts in step with inventory writes.
+
+    Write paths hand it the ids of the items they changed after committing, so
+    alert bookkeeping never runs on the request path. Once a day it also picks
+    up items that entered the expiry window, using the expiry and stock-margin
+    indexes rather than scanning the table.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._scanned_on = None
+
+    def ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if not self._started:
+                threading.Thread(target=self._run, name='stock-alerts', daemon=True).start()
+                self._started = True
+
+    def submit(self, item_ids):
+        self.ensure_started()
+        self._queue.put(set(item_ids))
+
+    def _run(self):
+        item_ids = set()
+        retry_delay = STOCK_ALERT_RETRY_SECONDS
+        while True:
+            # Coalesce everything queued meanwhile into one pass
+            while True:
+                try:
+                    item_ids |= self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            try:
+                with app.app_context():
+                    if self._scanned_on != date.today():
+                        item_ids |= self._items_to_rescan()
+                        self._scanned_on = date.today()
+                    if item_ids:
+                        self._sync(item_ids)
+            except Exception as e:
+                # Keep the items for the next pass, which also takes whatever was queued meanwhile
+                logging.error(f"Error updating stock alerts, retrying in {retry_delay}s: {e}")
+                sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, STOCK_ALERT_MAX_RETRY_SECONDS)
+                continue
+            retry_delay = STOCK_ALERT_RETRY_SECONDS
+
+            try:
+                item_ids = self._queue.get(timeout=STOCK_ALERT_SCAN_SECONDS)
+            except queue.Empty:
+                item_ids = set()
+
+    def _items_to_rescan(self):
+        horizon = date.today() + timedelta(days=EXPIRY_WARNING_DAYS)
+        item_ids = set(db.session.execute(db.union(
+            db.select(InventoryItem.id).where(InventoryItem.expiry_date <= horizon),
+            db.select(InventoryItem.id).where(InventoryItem.quantity - InventoryItem.min_threshold <= 0)
+        )).scalars())
+        # Items whose alerts are still active, so resolved ones get cleared
+        source_keys = db.session.execute(
+            db.select(Alert.source_key).where(Alert.is_active == True, Alert.alert_type.in_(STOCK_ALERT_TYPES))
+        ).scalars()
+        return item_ids | {int(key.rsplit(':', 1)[1]) for key in source_keys}
+
+    def _sync(self, item_ids):
+        try:
+            changed = sync_stock_alerts(item_ids)
+        except IntegrityError:
+            # Another worker raised the same alert first; their row is now visible
+            db.session.rollback()
+            changed = sync_stock_alerts(item_ids)
+        if changed:
+            notify_change('alerts', [alert.to_dict() for alert in changed])
+
+
+stock_alert_worker = StockAlertWorker()
+
+
+@app.before_request
+def start_background_workers():
+    stock_alert_worker.ensure_started()
+
+# Request metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Sampling profiler for slow requests, off unless PROFILE_SLOW_REQUEST_MS is set
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get("PROFILE_SLOW_REQUEST_MS", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/hospital-profiles")
+PROFILE_SAMPLE_SECONDS = 0.005
+
+
+class RequestMetrics:
+    """Per-route latency histograms and SQL and serialization totals of this worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)  # (method, route, status) -> count
+        self._latency = {}  # (method, route) -> per-bucket counts, then the +Inf count
+        self._latency_sum = defaultdict(float)
+        self._sql_queries = defaultdict(int)  # (method, route) -> count
+        self._sql_seconds = defaultdict(float)
+        self._serialization_seconds = defaultdict(float)
+
+    def observe(self, method, route, status, seconds, sql_queries, sql_seconds, serialization_seconds):
+        key = (method, route)
+        with self._lock:
+            self._requests[(method, route, status)] += 1
+            buckets = self._latency.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1))
+            buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self._latency_sum[key] += seconds
+            self._sql_queries[key] += sql_queries
+            self._sql_seconds[key] += sql_seconds
+            self._serialization_seconds[key] += serialization_seconds
+
+    def render(self):
+        """The metrics in Prometheus text exposition format"""
+        with self._lock:
+            requests = dict(self._requests)
+            latency = {key: list(buckets) for key, buckets in self._latency.items()}
+            latency_sum = dict(self._latency_sum)
+            totals = [(name, kind, help_text, dict(values)) for name, kind, help_text, values in (
+                ('hospital_sql_queries_total', 'counter', 'SQL statements executed while handling requests',
+                 self._sql_queries),
+                ('hospital_sql_seconds_total', 'counter', 'Time spent in SQL statements while handling requests',
+                 self._sql_seconds),
+                ('hospital_serialization_seconds_total', 'counter',
+                 'Time spent in to_dict() and JSON encoding while handling requests', self._serialization_seconds),
+            )]
+
+        lines = ['# HELP hospital_requests_total Requests handled, by route and status',
+                 '# TYPE hospital_requests_total counter']
+        for (method, route, status), count in sorted(requests.items()):
+            lines.append(f'hospital_requests_total{{{metric_labels(method, route)},status="{status}"}} {count}')
+
+        lines += ['# HELP hospital_request_duration_seconds Time to handle a request, by route',
+                  '# TYPE hospital_request_duration_seconds histogram']
+        for (method, route), buckets in sorted(latency.items()):
+            labels = metric_labels(method, route)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'hospital_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'hospital_request_duration_seconds_sum{{{labels}}} {latency_sum[(method, route)]:.6f}')
+            lines.append(f'hospital_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        for name, kind, help_text, values in totals:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (method, route), value in sorted(values.items()):
+                value = value if isinstance(value, int) else f"{value:.6f}"
+                lines.append(f'{name}{{{metric_labels(method, route)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def metric_labels(method, route):
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of requests in flight and writes out those slower than the threshold.
+
+    Each slow request becomes a file of collapsed stacks ("frame;frame;frame
+    count" per line), ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, threshold_ms, directory):
+        self.threshold_seconds = threshold_ms / 1000
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._in_flight = {}  # thread id -> Counter of collapsed stacks
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._in_flight[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self, method, route, seconds):
+        with self._lock:
+            stacks = self._in_flight.pop(threading.get_ident(), None)
+        if not stacks or seconds < self.threshold_seconds:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9]+', '_', f"{method} {route}").strip('_')
+        path = os.path.join(self.directory, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{name}.folded")
+        with open(path, 'w') as profile:
+            profile.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        logging.info(f"Slow request {method} {route} took {seconds * 1000:.0f}ms; stacks written to {path}")
+
+    def _sample(self):
+        while True:
+            sleep(PROFILE_SAMPLE_SECONDS)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._in_flight.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+request_metrics = RequestMetrics()
+slow_request_profiler = SlowRequestProfiler(PROFILE_SLOW_REQUEST_MS, PROFILE_DIR) if PROFILE_SLOW_REQUEST_MS else None
+
+
+def count_query_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = perf_counter()
+
+
+def count_query_end(conn, cursor, statement, parameters, context, executemany):
+    if getattr(request_stats, 'active', False):
+        request_stats.sql_queries += 1
+        request_stats.sql_seconds += perf_counter() - conn.info['query_started']
+
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def explain_slow_query(conn, cursor, statement, parameters, context, executemany):
+    """Log the plan of any statement slower than SLOW_QUERY_MS"""
+    threshold = app.config["SLOW_QUERY_MS"]
+    elapsed_ms = (perf_counter() - conn.info['query_started']) * 1000
+    if not threshold or elapsed_ms < threshold or executemany \
+            or not statement.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+        return
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        # On the raw connection, so the EXPLAIN itself isn't counted or explained
+        explain_cursor = conn.connection.cursor()
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(f"    {row[-1]}" for row in explain_cursor.fetchall())
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        plan = f"    (no plan: {e})"
+    source = f"{request.method} {request.path}" if has_request_context() else threading.current_thread().name
+    logging.warning(f"Slow query ({elapsed_ms:.1f}ms) in {source}:\n  {statement}\n{plan}")
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', count_query_start)
+    event.listen(db.engine, 'after_cursor_execute', count_query_end)
+    event.listen(db.engine, 'after_cursor_execute', explain_slow_query)
+
+
+@app.before_request
+def start_request_metrics():
+    request_stats.started = perf_counter()
+    request_stats.sql_queries = 0
+    request_stats.sql_seconds = 0.0
+    request_stats.serialization_seconds = 0.0
+    request_stats.active = True
+    if slow_request_profiler:
+        slow_request_profiler.begin()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed bodies (SSE, NDJSON) count up to their first byte
+    if getattr(request_stats, 'active', False):
+        request_stats.active = False
+        seconds = perf_counter() - request_stats.started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_metrics.observe(request.method, route, response.status_code, seconds, request_stats.sql_queries,
+                                request_stats.sql_seconds, request_stats.serialization_seconds)
+        if slow_request_profiler:
+            slow_request_profiler.end(request.method, route, seconds)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Request metrics of this worker in Prometheus text format"""
+    return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# API Routes for Inventory
+@app.route('/api/inventory', methods=['GET'])
+@query_budget(1)
+def get_inventory():
+    """Get pharmacy inventory information"""
+    try:
+        return cached_json_response('inventory', build_inventory_state)
+    except Exception as e:
+        logging.error(f"Error getting inventory: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/inventory', methods=['POST'])
+# 'set' reads the previous quantity first; SQLite adds BEGIN IMMEDIATE and PostgreSQL a NOTIFY
+@query_budget(5)
+def update_inventory():
+    """Update inventory information"""
+    try:
+        data = request.get_json()
+        
+        if 'item_name' in data:
+            # Update specific item
+            begin_stock_transaction()
+            item_id = move_stock(data['item_name'], data.get('operation', 'set'), data.get('quantity', 0),
+                                 actor=data.get('actor'), note=data.get('note'))
+            db.session.commit()
+            item = db.session.get(InventoryItem, item_id).to_dict()
+            notify_change('inventory', [item])
+            stock_alert_worker.submit([item_id])
+
+            return jsonify({"status": "success", "message": "Inventory updated successfully", "item": item})
+        else:
+            return jsonify({"status": "success", "message": "Inventory updated successfully"})
+
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error updating inventory: {e}")
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/batch', methods=['POST'])
+@query_budget(5)
+def batch_update_inventory():
+    """Apply many stock changes, e.g. an end-of-shift count, in a single transaction.
+
+    Accepts {"changes": [{"item", "operation", "quantity", "note"}, ...], "actor"}.
+    """
+    try:
+        data = request.get_json() or {}
+        changes = data.get('changes')
+        if not isinstance(changes, list) or not 1 <= len(changes) <= BATCH_STOCK_LIMIT:
+            return jsonify({"status": "error", "message": f"A batch must hold 1 to {BATCH_STOCK_LIMIT} changes"}), 400
+
+        begin_stock_transaction()
+        results, changed = move_stock_batch(changes, actor=data.get('actor'))
+        db.session.commit()
+
+        if changed:
+            items = InventoryItem.query.filter(InventoryItem.id.in_(changed)).all()
+            notify_change('inventory', [item.to_dict() for item in items])
+            stock_alert_worker.submit(changed)
+
+        applied = sum(1 for result in results if result['status'] == 'success')
+        return jsonify({
+            "status": "success" if applied == len(results) else "partial",
+            "message": f"{applied} of {len(results)} changes applied",
+            "results": results
+        })
+
+    except Exception as e:
+        logging.error(f"Error updating inventory batch: {e}")
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/movements', methods=['GET'])
+@query_budget(1)
+def get_stock_movements():
+    """Get the stock ledger, newest first, optionally for one item"""
+    try:
+        query = db.session.query(StockMovement, InventoryItem.name) \
+            .join(InventoryItem, InventoryItem.id == StockMovement.item_id)
+        if request.args.get('item'):
+            query = query.filter(InventoryItem.name == request.args['item'])
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+
+        movements = query.order_by(StockMovement.id.desc()).limit(limit).all()
+        return jsonify({
+            "movements": [{**movement.to_dict(), 'item_name': name} for movement, name in movements],
+            "count": len(movements)
+        })
+    except Exception as e:
+        logging.error(f"Error getting stock movements: {e}")
+        return jsonify({"error": str(e)}), 500
+
+INVENTORY_STREAM_BATCH = 500
+
+
+def inventory_listing_query():
+    """Items matching the category, item_type and prefix query parameters, in name order"""
+    query = db.session.query(*inventory_row.columns)
+    if request.args.get('category'):
+        query = query.filter(InventoryItem.category == request.args['category'])
+    if request.args.get('item_type'):
+        query = query.filter(InventoryItem.item_type == request.args['item_type'])
+    if request.args.get('prefix'):
+        query = query.filter(InventoryItem.name.startswith(request.args['prefix'], autoescape=True))
+    return query.order_by(InventoryItem.name)
+
+@app.route('/api/inventory/items', methods=['GET'])
+@query_budget(1)
+def list_inventory_items():
+    """List inventory items page by page, or stream them all as NDJSON with ?format=ndjson.
+
+    Pages are keyed on the item name: pass the previous page's next_after as ?after=.
+    """
+    try:
+        query = inventory_listing_query()
+
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                # yield_per reads through a server-side cursor, so memory stays flat
+                for row in query.yield_per(INVENTORY_STREAM_BATCH):
+                    yield app.json.dumps(inventory_row(row)) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        limit, _ = page_args()
+        if request.args.get('after'):
+            query = query.filter(InventoryItem.name > request.args['after'])
+        items = inventory_row.all(query.limit(limit + 1))
+
+        return jsonify({
+            "items": items[:limit],
+            "next_after": items[limit - 1]['name'] if len(items) > limit else None
+        })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error listing inventory: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def page_args(default_limit=100, max_limit=1000):
+    """limit and offset query parameters, raising ValueError when out of range"""
+    limit = request.args.get('limit', default_limit, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not 1 <= limit <= max_limit or offset < 0:
+        raise ValueError(f"limit must be 1 to {max_limit} and offset non-negative")
+    return limit, offset
+
+@app.route('/api/inventory/low-stock', methods=['GET'])
+@query_budget(2)
+def get_low_stock():
+    """Get items at or below their reorder threshold, lowest margin first"""
+    try:
+        limit, offset = page_args()
+        return cached_json_response('inventory', lambda: build_low_stock_state(limit, offset),
+                                    key=f"inventory:low-stock:{limit}:{offset}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting low stock: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/inventory/expiring', methods=['GET'])
+@query_budget(2)
+def get_expiring_inventory():
+    """Get items expired or expiring within ?days= (default 30), soonest first"""
+    try:
+        days = request.args.get('days', 30, type=int)
+        if not 0 <= days <= 3650:
+            raise ValueError("days must be 0 to 3650")
+        limit, offset = page_args()
+        today = date.today()
+        return cached_json_response('inventory', lambda: build_expiring_state(today, days, limit, offset),
+                                    key=f"inventory:expiring:{today}:{days}:{limit}:{offset}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting expiring inventory: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# API Routes for Alerts
+@app.route('/api/alerts', methods=['GET'])
+@query_budget(1)
+def get_alerts():
+    """Get current alerts, or with ?location= only those for that location plus hospital-wide ones"""
+    try:
+        locations = display_locations(request.args.get('location'))
+        if locations:
+            # Each location's list is built once per change and shared by its displays
+            return cached_json_response('alerts', lambda: build_alert_state(locations),
+                                        key=f"alerts:{normalize_name(request.args['location'])}")
+        return cached_json_response('alerts', build_alert_state)
+    except Exception as e:
+        logging.error(f"Error getting alerts: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/alerts', methods=['POST'])
+@query_budget(2)
+def create_alert():
+    """Create new emergency alert"""
+    try:
+        data = request.get_json()
+        
+        new_alert = Alert(
             alert_type=data.get('type', 'general'),
             message=data.get('message', ''),
             location=data.get('location', ''),
@@ -322,6 +2576,7 @@ def create_alert():
         
         db.session.add(new_alert)
         db.session.commit()
+        notify_change('alerts', [new_alert.to_dict()])
         
         return jsonify({
             "status": "success", 
@@ -334,7 +2589,46 @@ def create_alert():
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def history_cursor_arg():
+    """The ?before= cursor of the alert history as (dismissed_at, id), raising ValueError when malformed"""
+    value = request.args.get('before')
+    if not value:
+        return None
+    dismissed_at, _, alert_id = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(dismissed_at), int(alert_id)
+    except ValueError:
+        raise ValueError("invalid before cursor")
+
+@app.route('/api/alerts/history', methods=['GET'])
+@query_budget(1)
+def get_alert_history():
+    """Get dismissed alerts, most recently dismissed first.
+
+    Pages are keyed on (dismissed_at, id): pass the previous page's next_before as ?before=.
+    """
+    try:
+        limit, _ = page_args(default_limit=50, max_limit=500)
+        # dismissed_at is only ever set on dismissal, so it alone selects the history
+        query = Alert.query.filter(Alert.dismissed_at.isnot(None))
+        before = history_cursor_arg()
+        if before:
+            query = query.filter(db.tuple_(Alert.dismissed_at, Alert.id) < db.tuple_(*before))
+        alerts = query.order_by(Alert.dismissed_at.desc(), Alert.id.desc()).limit(limit + 1).all()
+
+        last = alerts[limit - 1] if len(alerts) > limit else None
+        return jsonify({
+            "alerts": [alert.to_dict() for alert in alerts[:limit]],
+            "next_before": f"{last.dismissed_at.isoformat()}_{last.id}" if last else None
+        })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting alert history: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/alerts/<int:alert_id>', methods=['DELETE'])
+@query_budget(3)
 def dismiss_alert(alert_id):
     """Dismiss/deactivate an alert"""
     try:
@@ -343,6 +2637,7 @@ def dismiss_alert(alert_id):
         alert.dismissed_at = datetime.utcnow()
         
         db.session.commit()
+        notify_change('alerts', [alert.to_dict()])
         
         return jsonify({"status": "success", "message": "Alert dismissed successfully"})
         
@@ -352,65 +2647,212 @@ def dismiss_alert(alert_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # API Routes for Schedules
+SCHEDULE_TYPES = ('ot', 'consultation')
+SCHEDULE_RANGE_MAX_DAYS = 92
+BULK_SCHEDULE_LIMIT = 10000
+SCHEDULE_FILTERS = ('type', 'department', 'room', 'doctor')
+# API field -> Schedule column, as named by Schedule.to_dict()
+SCHEDULE_FIELDS = {
+    'schedule_type': 'schedule_type', 'department': 'department', 'doctor': 'doctor_name',
+    'procedure': 'procedure_name', 'patient_id': 'patient_id', 'room': 'room_number',
+    'start_time': 'start_time', 'end_time': 'end_time', 'date': 'schedule_date', 'status': 'status',
+    'anesthesiologist': 'anesthesiologist', 'total_appointments': 'total_appointments',
+    'completed': 'completed_appointments'
+}
+SCHEDULE_REQUIRED_FIELDS = ('schedule_type', 'start_time', 'end_time', 'date')
+
+
+class ScheduleConflict(ValueError):
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} booking conflict(s) with a room or clinician already booked")
+        self.conflicts = conflicts
+
+
+def date_arg(name, default=None):
+    """An ISO date query parameter, raising ValueError when malformed"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date like 2024-01-31")
+
+
+def date_range_args():
+    """from and to query parameters, defaulting to today, at most SCHEDULE_RANGE_MAX_DAYS apart"""
+    start = date_arg('from', date.today())
+    end = date_arg('to', start)
+    if not 0 <= (end - start).days < SCHEDULE_RANGE_MAX_DAYS:
+        raise ValueError(f"to must be on or after from and span at most {SCHEDULE_RANGE_MAX_DAYS} days")
+    return start, end
+
+
+def parse_schedule_row(row, number):
+    """Column values for one schedule of a write request, raising ValueError when invalid"""
+    if not isinstance(row, dict):
+        raise ValueError(f"Schedule {number} must be an object")
+    if row.get('id') is not None and not isinstance(row['id'], int):
+        raise ValueError(f"Schedule {number} has an invalid id")
+    values = {}
+    for field, column in SCHEDULE_FIELDS.items():
+        if field not in row:
+            continue
+        value = row[field]
+        try:
+            if column in ('start_time', 'end_time'):
+                value = time.fromisoformat(value)
+            elif column == 'schedule_date':
+                value = date.fromisoformat(value)
+            elif column in ('total_appointments', 'completed_appointments'):
+                if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                    raise ValueError
+            elif value is not None and not isinstance(value, str):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f"Schedule {number} has an invalid {field}")
+        values[column] = value
+    if 'schedule_type' in values and values['schedule_type'] not in SCHEDULE_TYPES:
+        raise ValueError(f"Schedule {number} must have schedule_type 'ot' or 'consultation'")
+    if 'id' not in row:
+        missing = [field for field in SCHEDULE_REQUIRED_FIELDS if field not in row]
+        if missing:
+            raise ValueError(f"Schedule {number} needs {', '.join(missing)}")
+    return values
+
+
+def save_schedules(rows):
+    """Create rows without an id and update those with one, in one transaction.
+
+    Returns the saved schedules' dicts, updated ones first; raises ValueError for invalid rows,
+    ScheduleConflict for double bookings and LookupError for ids that don't
+    exist, saving nothing.
+    """
+    parsed = [(row.get('id') if isinstance(row, dict) else None, parse_schedule_row(row, number))
+              for number, row in enumerate(rows, start=1)]
+
+    ids = {schedule_id for schedule_id, _ in parsed if schedule_id is not None}
+    existing = {schedule.id: schedule for schedule in Schedule.query.filter(Schedule.id.in_(ids))} if ids else {}
+    missing = ids - existing.keys()
+    if missing:
+        raise LookupError(f"Schedules not found: {', '.join(map(str, sorted(missing)))}")
+
+    saved = []
+    for number, (schedule_id, values) in enumerate(parsed, start=1):
+        schedule = existing[schedule_id] if schedule_id is not None else Schedule()
+        for column, value in values.items():
+            setattr(schedule, column, value)
+        if schedule.end_time <= schedule.start_time:
+            raise ValueError(f"Schedule {number} must end after it starts")
+        saved.append(schedule)
+
+    with db.session.no_autoflush:
+        conflicts = schedule_conflicts(saved, replaced_ids=ids)
+    if conflicts:
+        raise ScheduleConflict(conflicts)
+
+    # New schedules go in with one multi-row INSERT; serialize before commit expires the objects
+    new_rows = [values for schedule_id, values in parsed if schedule_id is None]
+    inserted = db.session.scalars(db.insert(Schedule).returning(Schedule), new_rows).all() if new_rows else []
+    db.session.flush()
+    schedules = [schedule.to_dict() for schedule in saved if schedule.id is not None]
+    schedules += [schedule.to_dict() for schedule in inserted]
+    db.session.commit()
+    return schedules
+
 @app.route('/api/schedules', methods=['GET'])
+@query_budget(1)
 def get_schedules():
-    """Get OT and consultation schedules"""
+    """Get one day's OT and consultation schedules (?date=, default today), or a filtered list.
+
+    With any of from, to, type, department, room or doctor, returns the
+    matching schedules between from and to (inclusive, at most 92 days).
+    """
     try:
-        today = date.today()
-        schedules = Schedule.query.filter_by(schedule_date=today).all()
-        
-        ot_schedules = {}
-        consultations = {}
-        
-        for schedule in schedules:
-            schedule_dict = schedule.to_dict()
-            key = f"{today}_{schedule.schedule_type}_{schedule.id}"
-            
-            if schedule.schedule_type == 'ot':
-                ot_schedules[key] = schedule_dict
-            else:
-                consultations[key] = schedule_dict
-        
-        return jsonify({
-            "ot_schedules": ot_schedules,
-            "consultations": consultations,
-            "last_updated": datetime.utcnow().isoformat()
-        })
+        if not any(request.args.get(name) for name in ('from', 'to') + SCHEDULE_FILTERS):
+            day = date_arg('date', date.today())
+            return cached_json_response('schedules', lambda: build_schedule_state(day), key=f"schedules:{day}")
+
+        start, end = date_range_args()
+        filters = {name: request.args.get(name) or None for name in SCHEDULE_FILTERS}
+        if filters['type'] and filters['type'] not in SCHEDULE_TYPES:
+            raise ValueError("type must be 'ot' or 'consultation'")
+        key = "schedules:range:" + ":".join([start.isoformat(), end.isoformat()] + [filters[name] or '' for name in SCHEDULE_FILTERS])
+        return cached_json_response('schedules', lambda: build_schedule_range(
+            start, end, filters['type'], filters['department'], filters['room'], filters['doctor']
+        ), key=key)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting schedules: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/schedules', methods=['POST'])
+@query_budget(4)
 def update_schedules():
-    """Update schedule information"""
+    """Create or update schedules in one transaction.
+
+    Accepts {"schedules": [...]} or a single schedule, with the fields of
+    Schedule.to_dict(); rows with an id update that schedule, the rest are
+    created. An invalid row, or a booking that double-books a room or
+    clinician, rejects the whole batch.
+    """
     try:
-        return jsonify({"status": "success", "message": "Schedules updated successfully"})
+        data = request.get_json() or {}
+        rows = data['schedules'] if 'schedules' in data else [data]
+        if not isinstance(rows, list) or not 1 <= len(rows) <= BULK_SCHEDULE_LIMIT:
+            return jsonify({"status": "error", "message": f"A batch must hold 1 to {BULK_SCHEDULE_LIMIT} schedules"}), 400
+
+        schedules = save_schedules(rows)
+        notify_change('schedules', schedules)
+
+        updated = sum(1 for row in rows if row.get('id') is not None)
+        return jsonify({
+            "status": "success",
+            "message": f"{len(rows) - updated} schedules created, {updated} updated",
+            "schedules": schedules
+        })
+
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except ScheduleConflict as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e), "conflicts": e.conflicts}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         logging.error(f"Error updating schedules: {e}")
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/schedules/conflicts', methods=['GET'])
+@query_budget(1)
+def get_schedule_conflicts():
+    """Get rooms and clinicians double-booked between from and to (default today)"""
+    try:
+        start, end = date_range_args()
+        return cached_json_response('schedules', lambda: build_schedule_conflicts(start, end),
+                                    key=f"schedules:conflicts:{start}:{end}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error getting schedule conflicts: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # Token advancement API
 @app.route('/api/tokens/advance/<department>', methods=['POST'])
+@query_budget(12)
 def advance_token(department):
     """Advance to next token for a department"""
     try:
-        # Get current token for department
-        current_token = Token.query.filter_by(department=department, is_current=True).first()
-        if current_token:
-            current_token.is_current = False
-            current_token.status = 'completed'
-        
-        # Get next waiting token
-        next_token = Token.query.filter_by(
-            department=department, 
-            is_current=False, 
-            status='waiting'
-        ).order_by(Token.created_at).first()
+        current_token, next_token, consultation = advance_department_queue(department)
+        if consultation:
+            notify_change('schedules', [consultation.to_dict()])
         
         if next_token:
-            next_token.is_current = True
-            next_token.status = 'in_progress'
-            db.session.commit()
+            notify_change('tokens', [token.to_dict() for token in (current_token, next_token) if token])
             
             return jsonify({
                 "status": "success", 
@@ -418,7 +2860,8 @@ def advance_token(department):
                 "token": next_token.to_dict()
             })
         else:
-            db.session.commit()
+            if current_token:
+                notify_change('tokens', [current_token.to_dict()])
             return jsonify({"status": "info", "message": "No tokens in queue"})
             
     except Exception as e:
@@ -426,6 +2869,59 @@ def advance_token(department):
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Combined snapshot for the dashboard
+SNAPSHOT_RESOURCES = ('tokens', 'alerts', 'inventory', 'schedules')  # served when include= is absent
+
+
+def snapshot_read_models():
+    """Resource, cache key and builder of each view, shared with the view's own GET endpoint"""
+    today = date.today()
+    return {
+        'tokens': ('tokens', 'tokens:all', build_token_state),
+        'alerts': ('alerts', 'alerts', build_alert_state),
+        'inventory': ('inventory', 'inventory', build_inventory_state),
+        'low_stock': ('inventory', 'inventory:low-stock:100:0', lambda: build_low_stock_state(100, 0)),
+        'schedules': ('schedules', f"schedules:{today}", lambda: build_schedule_state(today))
+    }
+
+
+def begin_consistent_read():
+    """Start a transaction in which every query sees the same snapshot of the database"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # Deferred BEGIN holds the shared lock from the first read until the end
+        db.session.execute(db.text("BEGIN"))
+    else:
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+
+@app.route('/api/snapshot', methods=['GET'])
+@query_budget(8)
+def get_snapshot():
+    """Get tokens, alerts, inventory and schedules in one response, or the views named in include="""
+    try:
+        include = request.args.get('include')
+        resources = [name.strip() for name in include.split(',') if name.strip()] if include else SNAPSHOT_RESOURCES
+        read_models = snapshot_read_models()
+        unknown = set(resources) - set(read_models)
+        if unknown:
+            return jsonify({"status": "error", "message": f"Unknown resources: {', '.join(sorted(unknown))}"}), 400
+
+        begin_consistent_read()
+        entries = {}
+        for view in dict.fromkeys(resources):
+            resource, key, build = read_models[view]
+            entries[view] = cached_entry((resource,), key, lambda build=build: app.json.dumps(build()))
+        db.session.commit()
+
+        # Splice the cached bodies together rather than serializing them again
+        body = '{' + ','.join(f'"{resource}":{entry["body"]}' for resource, entry in entries.items()) + '}'
+        etag = hashlib.sha1(' '.join(entry['etag'] for entry in entries.values()).encode('utf-8')).hexdigest()
+        return conditional_response({'body': body, 'etag': etag}, 'application/json')
+    except Exception as e:
+        logging.error(f"Error getting snapshot: {e}")
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
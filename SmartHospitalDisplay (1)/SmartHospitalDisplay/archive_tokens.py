@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Day-rollover job: move completed and stale tokens out of the live queue
+into token_history. Run it once a day after OPD closes, e.g. from cron:
+
+    0 23 * * * cd /srv/hospital && python archive_tokens.py
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+from datetime import date
+
+from app import app, archive_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive completed and stale tokens into token_history")
+    parser.add_argument('--before', type=date.fromisoformat, default=None,
+                        help='archive every token created before this date in the display timezone (default: today)')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        archived = archive_tokens(before=args.before, batch_size=args.batch_size)
+    print(f"Archived {archived} token(s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Load test replaying a day of hospital traffic against the whole API.
+
+Seeds a hospital-sized database (departments, a formulary, a month of
+schedules), then replays a compressed OPD day: token issuance in bursts
+and one at a time, advances, dispensing, alerts raised and dismissed,
+while ward displays and dashboards poll the read endpoints the way the
+browser code does. Reports throughput and p50/p95/p99 latency per
+endpoint.
+
+Requests go through the Flask test client in this process, or over HTTP
+to a running server with --base-url (which must use the same
+DATABASE_URL, so it sees the seeded data). Point DATABASE_URL at SQLite
+or a local PostgreSQL; the database is cleared first.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_hospital_day.py --save day.json
+    DATABASE_URL=postgresql://localhost/hospital_bench python benchmark_hospital_day.py --compare day.json
+
+With --compare, exits non-zero when an endpoint's p95 is more than
+--tolerance slower than in the saved run, or any request failed.
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import json
+import logging
+import random
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from time import perf_counter
+
+from app import app, db, InventoryItem, Schedule, record_opening_stock
+from benchmark_token_queries import percentile
+
+BATCH_SIZE = 5000
+OT_ROOMS = 20
+
+
+class Recorder:
+    """Latency samples and failures per endpoint, shared by every client thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def record(self, endpoint, elapsed_ms, status):
+        with self._lock:
+            self.samples[endpoint].append(elapsed_ms)
+            if status >= 500:
+                self.failures[endpoint] += 1
+
+
+class Client:
+    """One display's or writer's connection, in-process or over HTTP, timing every request"""
+
+    def __init__(self, recorder, base_url=None):
+        self.recorder = recorder
+        self.base_url = base_url
+        self.test_client = None if base_url else app.test_client()
+
+    def request(self, endpoint, method, path, body=None, etag=None):
+        """Returns (status, ETag, parsed JSON or None)"""
+        headers = {'If-None-Match': etag} if etag else {}
+        start = perf_counter()
+        if self.test_client:
+            response = self.test_client.open(path, method=method, json=body, headers=headers)
+            status, response_etag = response.status_code, response.headers.get('ETag')
+            data = response.get_json(silent=True)
+        else:
+            status, response_etag, data = self._http(method, path, body, headers)
+        self.recorder.record(endpoint, (perf_counter() - start) * 1000, status)
+        return status, response_etag, data
+
+    def _http(self, method, path, body, headers):
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, method=method, headers=headers,
+                                         data=json.dumps(body).encode('utf-8') if body is not None else None)
+        try:
+            with urllib.request.urlopen(request) as response:
+                payload = response.read()
+                content_type = response.headers.get('Content-Type', '')
+                data = json.loads(payload) if content_type.startswith('application/json') else None
+                return response.status, response.headers.get('ETag'), data
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('ETag'), None
+
+
+def seed_hospital(departments, skus, schedule_days, rng):
+    """A formulary and a month of OT and consultation schedules; tokens come from the replay"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        items = []
+        for number in range(skus):
+            medication = number % 3 != 0
+            quantity = rng.randint(0, 2000)
+            items.append({
+                'name': f"{'Medication' if medication else 'Supply'} {number:05d}", 'quantity': quantity,
+                'unit': 'tablets' if medication else 'units', 'min_threshold': rng.randint(10, 200),
+                'max_capacity': 2000, 'category': f"Category {number % 40:02d}",
+                'item_type': 'medication' if medication else 'supply',
+                'expiry_date': date.today() + timedelta(days=rng.randint(-10, 720)) if medication else None
+            })
+        for start in range(0, len(items), BATCH_SIZE):
+            db.session.execute(db.insert(InventoryItem), items[start:start + BATCH_SIZE])
+        db.session.commit()
+        record_opening_stock()
+
+        schedules = []
+        for offset in range(schedule_days):
+            day = date.today() + timedelta(days=offset)
+            for room in range(1, OT_ROOMS + 1):
+                for slot in range(6):
+                    schedules.append({
+                        'schedule_type': 'ot', 'room_number': f"OT-{room}", 'procedure_name': 'Procedure',
+                        'doctor_name': f"Dr. Surgeon {room}", 'anesthesiologist': f"Dr. Anesthetist {room}",
+                        'start_time': time(8 + slot * 2), 'end_time': time(9 + slot * 2, 30),
+                        'schedule_date': day, 'status': 'scheduled'
+                    })
+            for department in departments:
+                for start_hour in (9, 14):
+                    schedules.append({
+                        'schedule_type': 'consultation', 'department': department,
+                        'doctor_name': f"Dr. {department.title()} {start_hour}", 'start_time': time(start_hour),
+                        'end_time': time(start_hour + 3), 'schedule_date': day, 'status': 'scheduled',
+                        'total_appointments': 40, 'completed_appointments': 0
+                    })
+        for start in range(0, len(schedules), BATCH_SIZE):
+            db.session.execute(db.insert(Schedule), schedules[start:start + BATCH_SIZE])
+        db.session.commit()
+        return len(items), len(schedules)
+
+
+def day_of_traffic(departments, tokens, dispenses, alerts, skus, rng):
+    """Writer operations for one day in order, as (endpoint, method, path, body)"""
+    # Token traffic keeps its order; dispensing and alerts are spread across it
+    timeline = []
+    waiting = defaultdict(int)
+    issued = 0
+    while issued < tokens:
+        department = rng.choice(departments)
+        if rng.random() < 0.1:
+            count = min(rng.randint(10, 60), tokens - issued)
+            timeline.append(('POST /api/tokens/bulk', 'POST', '/api/tokens/bulk',
+                             {'department': department, 'count': count, 'patient_type': 'General'}))
+        else:
+            count = 1
+            timeline.append(('POST /api/tokens', 'POST', '/api/tokens',
+                             {'department': department, 'patient_type': 'General'}))
+        issued += count
+        waiting[department] += count
+        # Roughly one advance per token issued, in departments with a queue
+        for _ in range(count):
+            busy = [name for name, queued in waiting.items() if queued]
+            if busy and rng.random() < 0.9:
+                department = rng.choice(busy)
+                waiting[department] -= 1
+                timeline.append(('POST /api/tokens/advance/<department>', 'POST',
+                                 f'/api/tokens/advance/{department}', None))
+
+    positioned = [(index / len(timeline), operation) for index, operation in enumerate(timeline)]
+    for _ in range(dispenses):
+        item = f"Medication {rng.randrange(skus - 1) // 3 * 3 + 1:05d}"
+        positioned.append((rng.random(), ('POST /api/inventory', 'POST', '/api/inventory', {
+            'item_name': item, 'operation': 'subtract', 'quantity': rng.randint(1, 5), 'actor': 'pharmacy'
+        })))
+    for _ in range(alerts):
+        raised = rng.random()
+        positioned.append((raised, ('POST /api/alerts', 'POST', '/api/alerts', {
+            'type': rng.choice(['general', 'general', 'maintenance', 'code_blue']),
+            'message': 'Load test alert', 'location': rng.choice(departments)
+        })))
+        positioned.append((raised + (1 - raised) * rng.random(), ('DELETE /api/alerts/<id>', 'DELETE', None, None)))
+    positioned.sort(key=lambda entry: entry[0])
+    return [operation for _, operation in positioned]
+
+
+def run_writers(operations, writers, recorder, base_url):
+    raised = []
+    raised_lock = threading.Lock()
+    local = threading.local()
+
+    def perform(operation):
+        endpoint, method, path, body = operation
+        if not hasattr(local, 'client'):
+            local.client = Client(recorder, base_url)
+        if endpoint.startswith('DELETE'):
+            with raised_lock:
+                if not raised:
+                    return
+                path = f"/api/alerts/{raised.pop(0)}"
+        status, _, data = local.client.request(endpoint, method, path, body)
+        if endpoint == 'POST /api/alerts' and status == 200:
+            with raised_lock:
+                raised.append(data['alert']['id'])
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        list(executor.map(perform, operations))
+
+
+def ward_display(department, recorder, base_url, interval, stopped):
+    """Polls like a patient screen with ?location= and a ward's fragment display"""
+    client = Client(recorder, base_url)
+    _, _, state = client.request('GET /api/tokens?department', 'GET', f'/api/tokens?department={department}')
+    cursor = state['cursor'] if state else 0
+    etags = {}
+    while not stopped.is_set():
+        status, _, changes = client.request('GET /api/tokens?since', 'GET',
+                                            f'/api/tokens?since={cursor}&department={department}')
+        if status == 200 and changes:
+            cursor = changes['cursor']
+        for endpoint, path in (('GET /api/alerts?location', f'/api/alerts?location={department}'),
+                               ('GET /patient/<department>/fragment', f'/patient/{department}/fragment')):
+            _, etags[path], _ = client.request(endpoint, 'GET', path, etag=etags.get(path))
+        stopped.wait(interval)
+
+
+def dashboard(recorder, base_url, interval, stopped):
+    """Polls like the central dashboard and staff panel"""
+    client = Client(recorder, base_url)
+    week = f"from={date.today()}&to={date.today() + timedelta(days=6)}"
+    paths = (('GET /api/snapshot', '/api/snapshot?include=tokens,alerts,low_stock,schedules'),
+             ('GET /api/inventory/low-stock', '/api/inventory/low-stock'),
+             ('GET /api/inventory/expiring', '/api/inventory/expiring?days=30'),
+             ('GET /api/inventory/items', '/api/inventory/items?limit=100'),
+             ('GET /api/schedules', '/api/schedules'),
+             ('GET /api/schedules?from&to', f'/api/schedules?{week}&type=ot'),
+             ('GET /api/alerts/history', '/api/alerts/history'))
+    etags = {}
+    while not stopped.is_set():
+        for endpoint, path in paths:
+            _, etags[path], _ = client.request(endpoint, 'GET', path, etag=etags.get(path))
+        stopped.wait(interval)
+
+
+def summarize(recorder, elapsed):
+    return {
+        endpoint: {
+            'requests': len(samples), 'per_second': len(samples) / elapsed,
+            'p50': percentile(samples, 50), 'p95': percentile(samples, 95), 'p99': percentile(samples, 99),
+            'failures': recorder.failures[endpoint]
+        }
+        for endpoint, samples in sorted(recorder.samples.items())
+    }
+
+
+def regressions(results, baseline, tolerance):
+    found = [f"{endpoint}: {stats['failures']} failed request(s)" for endpoint, stats in results.items()
+             if stats['failures']]
+    for endpoint, stats in results.items():
+        before = baseline.get(endpoint)
+        if before and stats['p95'] > before['p95'] * (1 + tolerance):
+            found.append(f"{endpoint}: p95 {stats['p95']:.2f}ms, was {before['p95']:.2f}ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--departments', type=int, default=50)
+    parser.add_argument('--tokens', type=int, default=20000, help='tokens issued over the day')
+    parser.add_argument('--skus', type=int, default=20000, help='formulary size')
+    parser.add_argument('--schedule-days', type=int, default=31)
+    parser.add_argument('--dispenses', type=int, default=5000)
+    parser.add_argument('--alerts', type=int, default=100)
+    parser.add_argument('--writers', type=int, default=8, help='parallel writer threads')
+    parser.add_argument('--displays', type=int, default=50, help='polling ward displays')
+    parser.add_argument('--dashboards', type=int, default=2)
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between a display\'s polls')
+    parser.add_argument('--base-url', help='server to load instead of the in-process test client')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='fail on regressions against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slow-down with --compare')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(42)
+    departments = [f"department{index:02d}" for index in range(args.departments)]
+    base_url = args.base_url.rstrip('/') if args.base_url else None
+
+    print("Seeding...")
+    skus, schedules = seed_hospital(departments, args.skus, args.schedule_days, rng)
+    operations = day_of_traffic(departments, args.tokens, args.dispenses, args.alerts, args.skus, rng)
+    print(f"  {skus:,} SKUs, {schedules:,} schedules; replaying {len(operations):,} writes "
+          f"with {args.displays} displays and {args.dashboards} dashboards polling")
+
+    recorder = Recorder()
+    stopped = threading.Event()
+    pollers = [threading.Thread(target=ward_display, daemon=True,
+                                args=(departments[index % len(departments)], recorder, base_url,
+                                      args.poll_interval, stopped))
+               for index in range(args.displays)]
+    pollers += [threading.Thread(target=dashboard, daemon=True,
+                                 args=(recorder, base_url, args.poll_interval, stopped))
+                for _ in range(args.dashboards)]
+
+    start = perf_counter()
+    for poller in pollers:
+        poller.start()
+    run_writers(operations, args.writers, recorder, base_url)
+    stopped.set()
+    for poller in pollers:
+        poller.join()
+    elapsed = perf_counter() - start
+
+    results = summarize(recorder, elapsed)
+    total = sum(stats['requests'] for stats in results.values())
+    print(f"\n{total:,} requests in {elapsed:.1f}s ({total / elapsed:,.0f}/s)")
+    print(f"{'endpoint':<40}{'requests':>10}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'failed':>8}")
+    for endpoint, stats in results.items():
+        print(f"{endpoint:<40}{stats['requests']:>10,}{stats['per_second']:>9.1f}{stats['p50']:>8.2f}ms"
+              f"{stats['p95']:>8.2f}ms{stats['p99']:>8.2f}ms{stats['failures']:>8}")
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            found = regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
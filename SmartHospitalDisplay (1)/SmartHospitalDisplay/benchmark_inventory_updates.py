@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark for end-of-shift inventory updates.
+
+Seeds the given number of items, then records a stock count for every one
+of them, first one request at a time through POST /api/inventory and then
+in a single POST /api/inventory/batch, and reports the wall-clock time of
+each. Runs against the database in DATABASE_URL, which it clears before
+every run.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_inventory_updates.py --sizes 500 5000
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+from time import perf_counter
+
+from app import app, db, InventoryItem, StockMovement, record_opening_stock
+
+
+def seed_items(count):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(db.insert(InventoryItem), [
+            {'name': f"Item {number:05d}", 'quantity': 100, 'unit': 'pieces', 'min_threshold': 20,
+             'max_capacity': 500, 'category': 'Benchmark', 'item_type': 'supply'}
+            for number in range(count)
+        ])
+        db.session.commit()
+        record_opening_stock()
+
+
+def stock_count(count):
+    """A count that finds some items short and some over"""
+    return [{'item': f"Item {number:05d}", 'operation': 'set', 'quantity': 90 + number % 20}
+            for number in range(count)]
+
+
+def update_one_by_one(client, changes):
+    for change in changes:
+        response = client.post('/api/inventory', json={
+            'item_name': change['item'], 'operation': change['operation'], 'quantity': change['quantity']
+        })
+        assert response.status_code == 200, response.get_json()
+
+
+def update_in_batch(client, changes):
+    response = client.post('/api/inventory/batch', json={'changes': changes})
+    assert response.status_code == 200 and response.get_json()['status'] == 'success', response.get_json()
+
+
+def timed(update, count):
+    seed_items(count)
+    changes = stock_count(count)
+    client = app.test_client()
+    start = perf_counter()
+    update(client, changes)
+    elapsed = perf_counter() - start
+    with app.app_context():
+        assert StockMovement.query.count() == 2 * count
+        assert db.session.query(db.func.sum(InventoryItem.quantity)).scalar() == \
+            sum(change['quantity'] for change in changes)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 5000])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print(f"{'items':>8}{'per-item':>14}{'batch':>12}{'speed-up':>10}")
+    for count in args.sizes:
+        single = timed(update_one_by_one, count)
+        batch = timed(update_in_batch, count)
+        print(f"{count:>8,}{single:>12.2f}s{batch:>10.3f}s{single / batch:>9.1f}x"
+              f"   ({count / single:,.0f} vs {count / batch:,.0f} updates/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark for schedule conflict checking.
+
+Stores a month of OT bookings, then validates a second month-long import
+against them with the interval index behind POST /api/schedules and with
+a pairwise comparison of every booking on the same day, reporting the time
+and conflicts found by each. Runs against the database in DATABASE_URL,
+which it clears first.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_schedule_conflicts.py --rooms 20 --conflicts 25
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+import random
+from collections import defaultdict
+from datetime import date, time, timedelta
+from time import perf_counter
+
+from app import app, db, Schedule, holding_schedules, schedule_conflicts, schedule_resources, minutes
+
+SLOTS_PER_DAY = 12  # hour-long bookings from 08:00
+
+
+def booking(room, day, slot, length=60):
+    start = 8 * 60 + slot * 60
+    return Schedule(
+        schedule_type='ot', room_number=f"OT-{room}", doctor_name=f"Dr. Surgeon {room}",
+        anesthesiologist=f"Dr. Anesthetist {room}", procedure_name='Procedure', status='scheduled',
+        start_time=time(start // 60, start % 60), end_time=time((start + length) // 60, (start + length) % 60),
+        schedule_date=day
+    )
+
+
+def month_of_bookings(rooms, first_day, slots):
+    return [booking(room, first_day + timedelta(days=offset), slot)
+            for offset in range(31) for room in range(1, rooms + 1) for slot in slots]
+
+
+def pairwise_conflicts(schedules):
+    """Compare every new booking with every other booking on its date"""
+    by_date = defaultdict(list)
+    for schedule in holding_schedules().filter(Schedule.schedule_date.in_({s.schedule_date for s in schedules})):
+        by_date[schedule.schedule_date].append(schedule)
+
+    conflicts = 0
+    for schedule in schedules:
+        resources = {resource for resource, _ in schedule_resources(schedule)}
+        for other in by_date[schedule.schedule_date]:
+            if (minutes(other.start_time) < minutes(schedule.end_time)
+                    and minutes(schedule.start_time) < minutes(other.end_time)):
+                conflicts += len(resources & {resource for resource, _ in schedule_resources(other)})
+        by_date[schedule.schedule_date].append(schedule)
+    return conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--conflicts', type=int, default=25, help='double bookings planted in the import')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    first_day = date.today() + timedelta(days=1)
+    rng = random.Random(42)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        # Mornings are already booked; the import fills the afternoons
+        stored = month_of_bookings(args.rooms, first_day, range(SLOTS_PER_DAY // 2))
+        db.session.add_all(stored)
+        db.session.commit()
+        incoming = month_of_bookings(args.rooms, first_day, range(SLOTS_PER_DAY // 2, SLOTS_PER_DAY))
+        for _ in range(args.conflicts):
+            # A longer booking over two of the room's morning slots
+            incoming.append(booking(rng.randint(1, args.rooms), first_day + timedelta(days=rng.randrange(31)),
+                                    rng.randrange(SLOTS_PER_DAY // 2 - 1), length=90))
+        print(f"{len(stored):,} stored bookings, validating an import of {len(incoming):,}")
+
+        with db.session.no_autoflush:
+            start = perf_counter()
+            indexed = schedule_conflicts(incoming)
+            indexed_time = perf_counter() - start
+
+            start = perf_counter()
+            pairwise = pairwise_conflicts(incoming)
+            pairwise_time = perf_counter() - start
+
+    print(f"{'method':<16}{'time':>10}{'conflicts':>12}")
+    print(f"{'interval index':<16}{indexed_time:>9.3f}s{len(indexed):>12,}")
+    print(f"{'pairwise':<16}{pairwise_time:>9.3f}s{pairwise:>12,}")
+
+if __name__ == '__main__':
+    main()
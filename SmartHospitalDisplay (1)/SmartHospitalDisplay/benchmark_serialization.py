@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark for response serialization.
+
+Builds the token queue and inventory payloads both ways: ORM objects through
+to_dict() and Flask's standard JSON encoder, and column-projected rows
+through the precompiled row serializers and the app's encoder (orjson when
+installed). Reports CPU time and peak memory allocated per response, after
+checking that both produce the same JSON. Runs against the database in
+DATABASE_URL, which it clears first.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_serialization.py --tokens 10000 --items 20000
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import json
+import logging
+import tracemalloc
+from datetime import date, datetime, timedelta
+from time import process_time
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import app, db, orjson, Token, InventoryItem, token_row, inventory_row
+from benchmark_token_queries import percentile
+
+
+def seed(tokens, items):
+    now = datetime.utcnow()
+    db.session.execute(db.insert(Token), [{
+        'department': f"department{number % 20:02d}", 'token_number': f"T{number:05d}",
+        'patient_type': 'General', 'status': 'waiting', 'is_current': False,
+        'created_at': now + timedelta(seconds=number), 'updated_at': now + timedelta(seconds=number)
+    } for number in range(tokens)])
+    db.session.execute(db.insert(InventoryItem), [{
+        'name': f"Item {number:05d}", 'quantity': number % 500, 'unit': 'units', 'min_threshold': 50,
+        'max_capacity': 500, 'category': f"category{number % 30}",
+        'item_type': 'medication' if number % 2 else 'supply',
+        'expiry_date': date.today() + timedelta(days=number % 720) if number % 2 else None
+    } for number in range(items)])
+    db.session.commit()
+
+
+def orm_payload(model):
+    return [row.to_dict() for row in model.query.order_by(model.id)]
+
+
+def row_payload(model, serializer):
+    return serializer.all(db.session.query(*serializer.columns).order_by(model.id))
+
+
+def measure(build, encode, iterations):
+    """CPU milliseconds to build and encode the payload, and peak bytes allocated doing so"""
+    samples = []
+    for _ in range(iterations):
+        start = process_time()
+        encode(build())
+        samples.append((process_time() - start) * 1000)
+        db.session.remove()  # a fresh session per response, as in a request
+
+    tracemalloc.start()
+    body = encode(build())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return percentile(samples, 50), peak, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=10000)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=10, help='timed responses per payload and path')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    standard_json = DefaultJSONProvider(app)
+    print(f"Encoder: {'orjson' if orjson else 'standard library json (orjson is not installed)'}")
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.tokens, args.items)
+
+        print(f"{'payload':<24}{'path':<18}{'cpu p50':>12}{'peak alloc':>14}")
+        for label, model, serializer in ((f"{args.tokens:,} tokens", Token, token_row),
+                                         (f"{args.items:,} inventory items", InventoryItem, inventory_row)):
+            orm_ms, orm_peak, orm_body = measure(lambda: orm_payload(model), standard_json.dumps, args.iterations)
+            row_ms, row_peak, row_body = measure(lambda: row_payload(model, serializer), app.json.dumps,
+                                                 args.iterations)
+            assert json.loads(orm_body) == json.loads(row_body), f"{label}: payloads differ"
+
+            print(f"{label:<24}{'to_dict + json':<18}{orm_ms:>10.1f}ms{orm_peak / 2**20:>12.1f}MB")
+            print(f"{'':<24}{'rows + encoder':<18}{row_ms:>10.1f}ms{row_peak / 2**20:>12.1f}MB"
+                  f"   ({orm_ms / row_ms:.1f}x less CPU, {orm_peak / row_peak:.1f}x less memory)")
+
+if __name__ == '__main__':
+    main()
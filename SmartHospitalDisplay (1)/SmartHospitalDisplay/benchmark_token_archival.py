@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the day-rollover job.
+
+Simulates a number of OPD days, with and without running archive_tokens()
+at each rollover, and reports get_tokens poll latency and live table size
+at checkpoints. Runs against the database in DATABASE_URL, which it
+clears first.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_token_archival.py --days 90
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+import random
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+
+from app import app, db, Token, TokenHistory, archive_tokens, build_token_state
+from benchmark_token_queries import percentile
+
+
+def issue_day(day, departments, tokens_per_day, leftover_ratio, rng):
+    """A day's tokens: most served and completed, a few still waiting at closing time"""
+    opening = datetime.combine(day, time(8, 0))
+    rows = []
+    for number in range(tokens_per_day):
+        department = departments[number % len(departments)]
+        created_at = opening + timedelta(seconds=number * 8)
+        status = 'waiting' if rng.random() < leftover_ratio else 'completed'
+        rows.append({
+            'department': department, 'token_number': f"{department[:2].upper()}{number:04d}",
+            'patient_type': 'General', 'status': status, 'is_current': False,
+            'created_at': created_at, 'updated_at': created_at
+        })
+    db.session.execute(db.insert(Token), rows)
+    db.session.commit()
+
+
+def measure_poll(iterations):
+    samples = []
+    for _ in range(iterations):
+        start = perf_counter()
+        build_token_state()
+        samples.append((perf_counter() - start) * 1000)
+        db.session.expunge_all()
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def simulate(days, departments, tokens_per_day, leftover_ratio, iterations, archive):
+    rng = random.Random(42)
+    checkpoints = sorted({1, days // 3, 2 * days // 3, days} - {0})
+    first_day = date.today() - timedelta(days=days)
+    results = []
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            if archive:
+                archive_tokens(before=day)
+            issue_day(day, departments, tokens_per_day, leftover_ratio, rng)
+
+            if offset + 1 in checkpoints:
+                p50, p99 = measure_poll(iterations)
+                results.append((offset + 1, Token.query.count(), TokenHistory.query.count(), p50, p99))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--departments', type=int, default=20)
+    parser.add_argument('--tokens-per-day', type=int, default=4000)
+    parser.add_argument('--leftover-ratio', type=float, default=0.01,
+                        help='share of tokens still waiting when the day ends')
+    parser.add_argument('--iterations', type=int, default=50, help='timed polls per checkpoint')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    departments = [f"department{index:02d}" for index in range(args.departments)]
+
+    for archive in (False, True):
+        print(f"\n{'With' if archive else 'Without'} day-rollover archival:")
+        print(f"{'day':>5}{'live rows':>12}{'history rows':>14}{'poll p50':>12}{'poll p99':>12}")
+        for day, live, history, p50, p99 in simulate(args.days, departments, args.tokens_per_day,
+                                                     args.leftover_ratio, args.iterations, archive):
+            print(f"{day:>5}{live:>12,}{history:>14,}{p50:>10.2f}ms{p99:>10.2f}ms")
+
+if __name__ == '__main__':
+    main()
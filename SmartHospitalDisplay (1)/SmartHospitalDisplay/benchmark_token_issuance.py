@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark for token issuance.
+
+Issues the same number of tokens one request at a time through
+POST /api/tokens and in a single POST /api/tokens/bulk, and reports the
+wall-clock time and tokens per second of each. Runs against the database
+in DATABASE_URL, which it clears before every run.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_token_issuance.py --sizes 1000 10000
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+from time import perf_counter
+
+from app import app, db, Token
+
+
+def reset_database():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+
+def issue_one_by_one(client, count):
+    for number in range(1, count + 1):
+        response = client.post('/api/tokens', json={
+            'department': 'general', 'token_number': f"G{number:05d}", 'patient_type': 'General'
+        })
+        assert response.status_code == 200, response.get_json()
+
+
+def issue_in_bulk(client, count):
+    response = client.post('/api/tokens/bulk', json={
+        'tokens': [{'department': 'general', 'token_number': f"G{number:05d}", 'patient_type': 'General'}
+                   for number in range(1, count + 1)]
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def timed(issue, count):
+    reset_database()
+    client = app.test_client()
+    start = perf_counter()
+    issue(client, count)
+    elapsed = perf_counter() - start
+    with app.app_context():
+        assert Token.query.count() == count
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print(f"{'tokens':>8}{'per-token':>14}{'bulk':>12}{'speed-up':>10}")
+    for count in args.sizes:
+        single = timed(issue_one_by_one, count)
+        bulk = timed(issue_in_bulk, count)
+        print(f"{count:>8,}{single:>12.2f}s{bulk:>10.3f}s{single / bulk:>9.1f}x"
+              f"   ({count / single:,.0f} vs {count / bulk:,.0f} tokens/s)")
+
+if __name__ == '__main__':
+    main()
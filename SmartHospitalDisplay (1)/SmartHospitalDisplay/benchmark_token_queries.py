@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Token queue hot path.
+
+Seeds a large token history plus a live queue, then times the queries
+behind get_tokens and advance_token without and with the hot-path
+indexes, printing p50/p99 latency and query plans. Runs against the
+database in DATABASE_URL, which it clears first.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark_token_queries.py --rows 1000000
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from app import app, db, Token, token_state_query
+
+HOT_PATH_INDEXES = ('uq_token_current_department', 'ix_token_queue',
+                    'ix_token_department_queue', 'ix_token_current')
+BATCH_SIZE = 20000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def seed_tokens(rows, departments, waiting_per_department):
+    """Completed history spread over the past year, plus today's live queue"""
+    now = datetime.utcnow()
+    rng = random.Random(42)
+
+    batch = []
+    for number in range(rows):
+        department = departments[number % len(departments)]
+        created_at = now - timedelta(days=rng.randint(1, 365), seconds=rng.randint(0, 86400))
+        batch.append({
+            'department': department, 'token_number': f"H{number:07d}", 'patient_type': 'General',
+            'status': 'completed', 'is_current': False, 'created_at': created_at, 'updated_at': created_at
+        })
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(db.insert(Token), batch)
+            db.session.commit()
+            batch = []
+            print(f"  {number + 1:,} historical tokens", end='\r')
+
+    for department in departments:
+        batch.append({
+            'department': department, 'token_number': f"{department[:2].upper()}000", 'patient_type': 'General',
+            'status': 'in_progress', 'is_current': True, 'created_at': now, 'updated_at': now
+        })
+        for number in range(1, waiting_per_department + 1):
+            created_at = now + timedelta(seconds=number)
+            batch.append({
+                'department': department, 'token_number': f"{department[:2].upper()}{number:03d}",
+                'patient_type': 'General', 'status': 'waiting', 'is_current': False,
+                'created_at': created_at, 'updated_at': created_at
+            })
+    db.session.execute(db.insert(Token), batch)
+    db.session.commit()
+    print(f"  {rows:,} historical tokens, {len(batch):,} live tokens")
+
+
+def hot_path_queries(department):
+    # The statements build_token_state and advance_department_queue run
+    return {
+        'get_tokens': token_state_query(),
+        'get_tokens department': token_state_query(department),
+        'advance_token next': Token.query.filter_by(
+            department=department, is_current=False, status='waiting'
+        ).order_by(Token.created_at).limit(1),
+    }
+
+
+def explain(query):
+    dialect = db.engine.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + str(compiled), params).all()
+    return [str(row[-1]) for row in rows]
+
+
+def measure(departments, iterations):
+    rng = random.Random(7)
+    results = {}
+    for name in hot_path_queries(departments[0]):
+        samples = []
+        for _ in range(iterations):
+            query = hot_path_queries(rng.choice(departments))[name]
+            start = perf_counter()
+            query.all()
+            samples.append((perf_counter() - start) * 1000)
+            db.session.expunge_all()
+        results[name] = (percentile(samples, 50), percentile(samples, 99))
+
+    for name, query in hot_path_queries(departments[0]).items():
+        print(f"  {name}:")
+        for line in explain(query):
+            print(f"    {line}")
+    return results
+
+
+def set_hot_path_indexes(create):
+    for index in Token.__table__.indexes:
+        if index.name in HOT_PATH_INDEXES:
+            if create:
+                index.create(bind=db.engine, checkfirst=True)
+            else:
+                index.drop(bind=db.engine, checkfirst=True)
+    # Refresh planner statistics so both runs see the same table
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='historical tokens to seed')
+    parser.add_argument('--departments', type=int, default=20)
+    parser.add_argument('--waiting', type=int, default=40, help='waiting tokens per department')
+    parser.add_argument('--iterations', type=int, default=200, help='timed runs per query')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    departments = [f"department{index:02d}" for index in range(args.departments)]
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        print("Seeding tokens...")
+        set_hot_path_indexes(create=False)
+        seed_tokens(args.rows, departments, args.waiting)
+
+        print("Without hot-path indexes:")
+        set_hot_path_indexes(create=False)
+        before = measure(departments, args.iterations)
+
+        print("With hot-path indexes:")
+        set_hot_path_indexes(create=True)
+        after = measure(departments, args.iterations)
+
+    print(f"\n{'query':<22}{'p50 before':>12}{'p99 before':>12}{'p50 after':>12}{'p99 after':>12}")
+    for name in before:
+        print(f"{name:<22}{before[name][0]:>10.2f}ms{before[name][1]:>10.2f}ms"
+              f"{after[name][0]:>10.2f}ms{after[name][1]:>10.2f}ms")
+
+if __name__ == '__main__':
+    main()
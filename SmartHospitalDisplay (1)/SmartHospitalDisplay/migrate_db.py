@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Script to bring an existing hospital database up to the current schema
+"""
+import sys
+sys.path.append('.')
+
+from app import app, db, record_opening_stock
+
+
+def resolve_duplicate_current_tokens():
+    """Keep only the most recently updated current token per department"""
+    rows = db.session.execute(db.text(
+        "SELECT id, department FROM token WHERE is_current "
+        "ORDER BY department, updated_at DESC, id DESC"
+    )).all()
+
+    seen = set()
+    stale_ids = []
+    for token_id, department in rows:
+        if department in seen:
+            stale_ids.append(token_id)
+        seen.add(department)
+
+    for token_id in stale_ids:
+        db.session.execute(db.text(
+            "UPDATE token SET is_current = :is_current, status = 'completed' WHERE id = :id"
+        ), {"is_current": False, "id": token_id})
+    db.session.commit()
+    print(f"  {len(stale_ids)} duplicate current token(s) completed")
+
+
+def record_missing_opening_stock():
+    """Start the stock ledger of items that predate it from their current quantity"""
+    print(f"  {record_opening_stock()} item(s) given an opening balance")
+
+
+def add_missing_columns():
+    """Add columns declared on the models to tables created before them"""
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"  {table.name}.{column.name}")
+    db.session.commit()
+
+
+# Data fix-ups that must run before the indexes that depend on them
+DATA_MIGRATIONS = [
+    ("Adding new columns...", add_missing_columns),
+    ("Resolving duplicate current tokens...", resolve_duplicate_current_tokens),
+    ("Recording opening stock...", record_missing_opening_stock),
+]
+
+
+def existing_index_names(connection, table):
+    if connection.dialect.name == 'sqlite':
+        # SQLite reflection skips expression indexes, so checkfirst can't see them
+        return set(connection.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+        ), {"table": table.name}).scalars())
+    return {index['name'] for index in db.inspect(connection).get_indexes(table.name)}
+
+
+def create_missing_indexes():
+    """Create every index declared on the models that the database lacks"""
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = existing_index_names(connection, table)
+            for index in table.indexes:
+                if index.name in existing:
+                    print(f"  {index.name} on {table.name} exists")
+                else:
+                    index.create(bind=connection)
+                    print(f"  {index.name} on {table.name} created")
+
+
+def migrate_database():
+    with app.app_context():
+        # New tables are created as-is; existing ones only gain indexes
+        db.create_all()
+
+        for description, migration in DATA_MIGRATIONS:
+            print(description)
+            migration()
+
+        print("Creating indexes...")
+        create_missing_indexes()
+
+        print("Database migrated successfully!")
+
+if __name__ == '__main__':
+    migrate_database()
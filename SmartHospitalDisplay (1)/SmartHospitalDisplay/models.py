@@ -1,5 +1,5 @@
-from datetime import datetime
-from app import db
+from datetime import datetime, date
+from app import db, timed_serialization
 
 
 class Token(db.Model):
@@ -12,6 +12,21 @@ class Token(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # At most one token per department may be "now serving"
+        db.Index('uq_token_current_department', 'department', unique=True,
+                 postgresql_where=db.text('is_current'), sqlite_where=db.text('is_current')),
+        # Waiting queue, all departments (get_tokens) and per department (advance_token)
+        db.Index('ix_token_queue', 'status', 'is_current', 'created_at',
+                 postgresql_where=db.text("status = 'waiting' AND NOT is_current")),
+        db.Index('ix_token_department_queue', 'department', 'status', 'is_current', 'created_at',
+                 postgresql_where=db.text("status = 'waiting' AND NOT is_current")),
+        # SQLite can't match partial indexes against bound parameters, so it
+        # needs a plain index for the "now serving" lookup as well
+        db.Index('ix_token_current', 'is_current', 'department').ddl_if(dialect='sqlite'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -20,10 +35,73 @@ class Token(db.Model):
             'patient_type': self.patient_type,
             'status': self.status,
             'is_current': self.is_current,
-            'timestamp': self.created_at.isoformat()
+            'timestamp': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class TokenHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.Integer, nullable=False)  # id the token had in the live table
+    department = db.Column(db.String(100), nullable=False)
+    token_number = db.Column(db.String(20), nullable=False)
+    patient_type = db.Column(db.String(50))
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_token_history_created', 'created_at'),
+        db.Index('ix_token_history_department_created', 'department', 'created_at'),
+    )
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'id': self.token_id,
+            'department': self.department,
+            'token_number': self.token_number,
+            'patient_type': self.patient_type,
+            'status': self.status,
+            'timestamp': self.created_at.isoformat() if self.created_at else None,
+            'archived_at': self.archived_at.isoformat() if self.archived_at else None
+        }
+
+
+class TokenCounter(db.Model):
+    department = db.Column(db.String(100), primary_key=True)
+    prefix = db.Column(db.String(10), nullable=False)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+    counter_date = db.Column(db.Date, nullable=False, default=date.today)
+    daily_reset = db.Column(db.Boolean, nullable=False, default=True)
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'department': self.department,
+            'prefix': self.prefix,
+            'last_number': self.last_number,
+            'counter_date': self.counter_date.isoformat() if self.counter_date else None,
+            'daily_reset': self.daily_reset
         }
 
 
+class TokenChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # the change cursor handed to clients
+    token_id = db.Column(db.Integer, nullable=False)
+    department = db.Column(db.String(100), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_token_change_department', 'department', 'id'),
+        # Finds the changes still inside the cursor's settle window
+        db.Index('ix_token_change_changed_at', 'changed_at'),
+        # Cursor ids must never be reused after the log is trimmed
+        {'sqlite_autoincrement': True},
+    )
+
+
 class InventoryItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, unique=True)
@@ -37,6 +115,16 @@ class InventoryItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Items at or below their reorder threshold: quantity - min_threshold <= 0
+        db.Index('ix_inventory_item_stock_margin', quantity - min_threshold, id),
+        db.Index('ix_inventory_item_expiry', 'expiry_date', 'id'),
+        # Keyset pages of the filtered listing, in name order
+        db.Index('ix_inventory_item_category_name', 'category', 'name'),
+        db.Index('ix_inventory_item_type_name', 'item_type', 'name'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -51,6 +139,35 @@ class InventoryItem(db.Model):
         }
 
 
+class StockMovement(db.Model):
+    """Append-only ledger of inventory changes; item quantities are its running totals"""
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(20), nullable=False)  # 'opening', 'add', 'subtract' or 'set'
+    change = db.Column(db.Integer, nullable=False)
+    quantity_after = db.Column(db.Integer, nullable=False)
+    actor = db.Column(db.String(100), nullable=True)
+    note = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stock_movement_item', 'item_id', 'id'),
+    )
+
+    @timed_serialization
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'operation': self.operation,
+            'change': self.change,
+            'quantity_after': self.quantity_after,
+            'actor': self.actor,
+            'note': self.note,
+            'timestamp': self.created_at.isoformat()
+        }
+
+
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     alert_type = db.Column(db.String(50), nullable=False)
@@ -60,7 +177,18 @@ class Alert(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     dismissed_at = db.Column(db.DateTime, nullable=True)
     created_by = db.Column(db.String(100), default='System')
+    source_key = db.Column(db.String(100), nullable=True)  # e.g. 'low_stock:12' for alerts raised by the system
 
+    __table_args__ = (
+        # One active alert per condition, however many workers raise it
+        db.Index('uq_alert_active_source', 'source_key', unique=True,
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+        # Reloading the active set, and keyset pages of the dismissed history
+        db.Index('ix_alert_active', 'is_active', 'created_at'),
+        db.Index('ix_alert_dismissed', 'dismissed_at', 'id'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
@@ -91,6 +219,12 @@ class Schedule(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Day and date-range lookups, split by OT and consultation
+        db.Index('ix_schedule_date_type', 'schedule_date', 'schedule_type'),
+    )
+
+    @timed_serialization
     def to_dict(self):
         return {
             'id': self.id,
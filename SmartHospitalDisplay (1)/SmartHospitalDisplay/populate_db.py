@@ -5,7 +5,7 @@ Script to populate the hospital database with sample data
 import sys
 sys.path.append('.')
 
-from app import app, db, Token, InventoryItem, Alert, Schedule
+from app import app, db, Token, InventoryItem, Alert, Schedule, record_opening_stock
 from datetime import datetime, date, time
 
 def populate_database():
@@ -95,6 +95,7 @@ def populate_database():
         
         # Commit all changes
         db.session.commit()
+        record_opening_stock()
         print("Database populated successfully!")
 
 if __name__ == '__main__':
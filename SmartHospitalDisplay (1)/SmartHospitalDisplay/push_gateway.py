@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Asyncio push gateway for the displays' live change streams.
+
+Serves GET /api/stream, the same Server-Sent Events feed as the Flask route,
+from a single event loop, so an idle ward display costs a socket and a
+small buffer instead of a whole gunicorn worker. Changes reach it through
+the app's change broker: PostgreSQL NOTIFY from every worker, or in-process
+with --wsgi, which also serves the rest of the app on the same port from a
+thread pool (a single-box or SQLite deployment).
+
+    DATABASE_URL=postgresql://... python push_gateway.py --port 5001
+    DATABASE_URL=sqlite:////tmp/hospital.db python push_gateway.py --port 5000 --wsgi
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import asyncio
+import contextvars
+import logging
+import resource
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import parse_headers
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from app import (app, db, change_broker, display_locations, ensure_change_listener, format_stream_event,
+                 stream_greeting, SSE_KEEPALIVE_SECONDS)
+
+STREAM_PATH = '/api/stream'
+STREAM_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                  b"Content-Type: text/event-stream\r\n"
+                  b"Cache-Control: no-cache\r\n"
+                  b"X-Accel-Buffering: no\r\n\r\n")
+MAX_HEADER_BYTES = 64 * 1024
+STREAM_BUFFER_LIMIT = 256 * 1024  # unsent bytes after which a stalled display is dropped
+LISTEN_BACKLOG = 4096  # displays reconnect all at once after a restart
+FAN_OUT_SLICE = 250  # streams written between chances for the loop to serve requests
+FAN_OUT_MAX_PAUSE = 0.05  # longest a slice waits for in-flight requests, so displays are never starved
+RESPONSE_CHUNK_BYTES = 64 * 1024  # response body read from the app per trip to the thread pool
+
+
+class StreamGateway:
+    """Holds the open display streams and writes every change to them from the event loop"""
+
+    def __init__(self, loop, executor=None):
+        self._loop = loop
+        self._executor = executor  # runs the Flask app for other paths; None serves streams only
+        self._streams = defaultdict(set)  # a display's locations -> the transports of the displays there
+        self._events = asyncio.Queue()
+        self._forwarding = 0  # requests being answered by the Flask app
+        self._no_requests = asyncio.Event()
+        self._no_requests.set()
+
+    def relay(self):
+        """Hand the change broker's events to the event loop; runs in its own thread"""
+        subscriber = change_broker.subscribe()
+        while True:
+            event = subscriber.get()
+            self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    async def publish(self):
+        """Write each event to every stream, in order"""
+        while True:
+            event = await self._events.get()
+            for locations, transports in list(self._streams.items()):
+                # Encoded once per distinct set of locations, not once per display
+                message = format_stream_event(event, locations)
+                if message:
+                    await self._fan_out(transports, message.encode())
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(SSE_KEEPALIVE_SECONDS)
+            for transports in list(self._streams.values()):
+                await self._fan_out(transports, b": keepalive\n\n")
+
+    async def _fan_out(self, transports, data):
+        """Write to the streams a slice at a time, letting requests go first in between.
+
+        Between slices the loop answers requests, and while the Flask app is
+        handling one, the fan-out waits (up to FAN_OUT_MAX_PAUSE) rather than
+        compete with it for the CPU, so a write such as advance_token isn't
+        held up behind thousands of displays.
+        """
+        transports = list(transports)
+        for start in range(0, len(transports), FAN_OUT_SLICE):
+            for transport in transports[start:start + FAN_OUT_SLICE]:
+                self._write(transport, data)
+            await asyncio.sleep(0)
+            if self._forwarding:
+                try:
+                    await asyncio.wait_for(self._no_requests.wait(), FAN_OUT_MAX_PAUSE)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _write(self, transport, data):
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > STREAM_BUFFER_LIMIT:
+            # A display that stopped reading reconnects and reloads rather than buffering here
+            transport.abort()
+            return
+        transport.write(data)
+
+    async def handle(self, reader, writer):
+        """Serve one connection: a display stream, or keep-alive requests for the Flask app"""
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, _, header_block = head.decode('latin-1').partition("\r\n")
+                method, target, version = request_line.split(' ', 2)
+                headers = parse_headers(BytesIO(header_block.encode('latin-1')))
+                url = urlsplit(target)
+
+                if method == 'GET' and url.path == STREAM_PATH:
+                    await self._stream(reader, writer, parse_qs(url.query).get('location', [None])[0])
+                    return
+                if 'Transfer-Encoding' in headers:
+                    # Bodies are only read by Content-Length; guessing would desync the connection
+                    writer.write(b"HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+                body = await reader.readexactly(int(headers.get('Content-Length', 0)))
+                if not await self._forward(writer, method, target, version, headers, body):
+                    return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        except Exception as e:
+            # The response may be half written, so the connection can only be closed
+            logging.error(f"Error answering a request: {e}")
+        finally:
+            writer.close()
+
+    async def _stream(self, reader, writer, location):
+        writer.write(STREAM_HEADERS + stream_greeting().encode())
+        locations = display_locations(location)
+        self._streams[locations].add(writer.transport)
+        try:
+            # Displays send nothing more; reading only notices when they hang up
+            while await reader.read(1024):
+                pass
+        finally:
+            self._streams[locations].discard(writer.transport)
+            if not self._streams[locations]:
+                del self._streams[locations]
+
+    async def _forward(self, writer, method, target, version, headers, body):
+        """Answer a request with the Flask app, returning whether the connection stays open"""
+        if self._executor is None:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+
+        environ = EnvironBuilder(path=target, method=method, headers=list(headers.items()), data=body,
+                                 environ_base={'REMOTE_ADDR': writer.get_extra_info('peername', ('', 0))[0]}
+                                 ).get_environ()
+        # A streamed body's request context lives in context variables, so every
+        # step of the response runs in the same context, whichever thread it's on
+        context = contextvars.copy_context()
+        self._forwarding += 1
+        self._no_requests.clear()
+        try:
+            app_iter, status, response_headers = await self._in_app(context, run_wsgi_app, app, environ)
+            try:
+                return await self._respond(writer, context, version, headers, app_iter, status, response_headers)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    await self._in_app(context, app_iter.close)
+        finally:
+            self._forwarding -= 1
+            if not self._forwarding:
+                self._no_requests.set()
+
+    def _in_app(self, context, function, *args):
+        return self._loop.run_in_executor(self._executor, context.run, function, *args)
+
+    async def _respond(self, writer, context, version, headers, app_iter, status, response_headers):
+        """Write the app's response as its iterator yields it, so streamed bodies stay streamed"""
+        keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+        # A body of unknown length is sent chunked, or to HTTP/1.0 clients delimited by closing
+        chunked = 'Content-Length' not in response_headers and keep_alive
+        if chunked:
+            response_headers['Transfer-Encoding'] = 'chunked'
+        elif 'Content-Length' not in response_headers:
+            keep_alive = False
+        response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f"HTTP/1.1 {status}\r\n" + "".join(f"{key}: {value}\r\n" for key, value in response_headers.items())
+        writer.write(head.encode('latin-1') + b"\r\n")
+
+        chunks = iter(app_iter)
+        while True:
+            data = await self._in_app(context, read_response, chunks)
+            if not data:
+                break
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+
+def read_response(chunks):
+    """The app's next RESPONSE_CHUNK_BYTES or so of response body; empty once it is done"""
+    data = bytearray()
+    for chunk in chunks:
+        data += chunk
+        if len(data) >= RESPONSE_CHUNK_BYTES:
+            break
+    return bytes(data)
+
+
+def raise_open_file_limit():
+    """Every display holds a socket open, so allow as many as the system does"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def serve(host, port, threads):
+    loop = asyncio.get_running_loop()
+    gateway = StreamGateway(loop, ThreadPoolExecutor(threads, thread_name_prefix='wsgi') if threads else None)
+    with app.app_context():
+        ensure_change_listener()
+    threading.Thread(target=gateway.relay, name='stream-relay', daemon=True).start()
+
+    server = await asyncio.start_server(gateway.handle, host, port, limit=MAX_HEADER_BYTES, backlog=LISTEN_BACKLOG)
+    logging.info(f"Push gateway listening on {host}:{port}{' with the Flask app' if threads else ''}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), gateway.publish(), gateway.keepalive())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--wsgi', action='store_true', help='also serve the rest of the app on this port')
+    parser.add_argument('--threads', type=int, default=16, help='Flask request threads with --wsgi')
+    args = parser.parse_args()
+
+    with app.app_context():
+        postgresql = db.engine.dialect.name == 'postgresql'
+    if not postgresql and not args.wsgi:
+        parser.error("without PostgreSQL NOTIFY the gateway only hears about changes made in its own process; "
+                     "pass --wsgi")
+
+    if args.wsgi and not app.config["LIVE_STREAM_URL"]:
+        # Pages served from here can stream from here
+        app.config["LIVE_STREAM_URL"] = STREAM_PATH
+    logging.info(f"Open file limit: {raise_open_file_limit():,}")
+    asyncio.run(serve(args.host, args.port, args.threads if args.wsgi else 0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Recompute every inventory item's quantity from the stock_movement ledger,
+reporting any item whose stored quantity had drifted from it.
+"""
+import sys
+sys.path.append('.')
+
+from app import app, rebuild_stock_levels
+
+
+def main():
+    with app.app_context():
+        drift = rebuild_stock_levels()
+    for name, (stored, ledger) in sorted(drift.items()):
+        print(f"  {name}: {stored} -> {ledger}")
+    print(f"Rebuilt stock levels, {len(drift)} item(s) corrected")
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,13 @@
 
 class HospitalDashboard {
     constructor() {
-        this.updateInterval = 30000; // 30 seconds
+        this.updateInterval = 30000; // 30 seconds fallback polling when the live stream is down
         this.intervals = [];
+        this.fetcher = new JsonFetcher();
+        this.live = new LiveUpdates({}, {
+            reload: () => this.loadOverviewData(),
+            interval: this.updateInterval
+        });
         this.init();
     }
 
@@ -11,9 +16,19 @@ class HospitalDashboard {
         this.updateCurrentTime();
         this.loadOverviewData();
         this.startAutoRefresh();
+        this.startLiveUpdates();
         this.setupEventListeners();
     }
 
+    startLiveUpdates() {
+        this.live.start(this.live.coalesce({
+            tokens: () => this.loadTokenSummary(),
+            alerts: () => this.loadAlerts(),
+            inventory: () => this.loadInventorySummary(),
+            schedules: () => this.loadScheduleSummary()
+        }));
+    }
+
     setupEventListeners() {
         // Refresh button
         const refreshBtn = document.getElementById('refreshBtn');
@@ -54,13 +69,13 @@ class HospitalDashboard {
     }
 
     async loadOverviewData() {
+        // One snapshot request instead of a request per section
         try {
-            await Promise.all([
-                this.loadAlerts(),
-                this.loadTokenSummary(),
-                this.loadInventorySummary(),
-                this.loadScheduleSummary()
-            ]);
+            const data = await this.fetcher.fetchJson('/api/snapshot?include=tokens,alerts,low_stock,schedules');
+            this.displayAlerts(data.alerts.active_alerts || []);
+            this.displayTokenSummary(data.tokens);
+            this.displayInventorySummary(data.low_stock);
+            this.displayScheduleSummary(data.schedules);
         } catch (error) {
             console.error('Error loading overview data:', error);
             this.showError('Failed to load dashboard data');
@@ -69,8 +84,7 @@ class HospitalDashboard {
 
     async loadAlerts() {
         try {
-            const response = await fetch('/api/alerts');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/alerts');
             this.displayAlerts(data.active_alerts || []);
         } catch (error) {
             console.error('Error loading alerts:', error);
@@ -121,14 +135,7 @@ class HospitalDashboard {
     async loadTokenSummary() {
         try {
             console.log('Loading token summary...');
-            const response = await fetch('/api/tokens');
-            console.log('Token summary response status:', response.status);
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/tokens');
             console.log('Token summary data:', data);
             this.displayTokenSummary(data);
         } catch (error) {
@@ -192,8 +199,7 @@ class HospitalDashboard {
 
     async loadInventorySummary() {
         try {
-            const response = await fetch('/api/inventory');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/inventory/low-stock');
             this.displayInventorySummary(data);
         } catch (error) {
             console.error('Error loading inventory summary:', error);
@@ -205,13 +211,10 @@ class HospitalDashboard {
         const inventorySummaryElement = document.getElementById('inventorySummary');
         if (!inventorySummaryElement) return;
 
-        const medications = data.medications || {};
-        const supplies = data.supplies || {};
-        
-        const allItems = { ...medications, ...supplies };
-        const itemNames = Object.keys(allItems);
+        // Only items at or below their threshold come from the server
+        const criticalItems = data.items || [];
 
-        if (itemNames.length === 0) {
+        if (!data.last_updated) {
             inventorySummaryElement.innerHTML = `
                 <div class="empty-state">
                     <i class="fas fa-boxes"></i>
@@ -222,25 +225,16 @@ class HospitalDashboard {
             return;
         }
 
-        // Show critical items (low stock)
-        const criticalItems = itemNames.filter(name => {
-            const item = allItems[name];
-            return item.quantity <= item.min_threshold;
-        });
-
         let summaryHtml = '';
 
         if (criticalItems.length > 0) {
             summaryHtml += '<h6 class="text-danger mb-3"><i class="fas fa-exclamation-triangle"></i> Critical Stock Levels</h6>';
-            summaryHtml += criticalItems.map(name => {
-                const item = allItems[name];
-                return `
-                    <div class="inventory-item">
-                        <div class="inventory-name">${name}</div>
-                        <div class="inventory-stock stock-low">${item.quantity} ${item.unit}</div>
-                    </div>
-                `;
-            }).join('');
+            summaryHtml += criticalItems.map(item => `
+                <div class="inventory-item">
+                    <div class="inventory-name">${item.name}</div>
+                    <div class="inventory-stock stock-low">${item.quantity} ${item.unit}</div>
+                </div>
+            `).join('');
         } else {
             summaryHtml = `
                 <div class="text-success">
@@ -252,7 +246,7 @@ class HospitalDashboard {
         summaryHtml += `
             <div class="mt-3">
                 <small class="text-muted">
-                    Total Items: ${itemNames.length} | 
+                    Critical Items: ${data.total} | 
                     Last Updated: ${this.formatTime(data.last_updated)}
                 </small>
             </div>
@@ -263,8 +257,7 @@ class HospitalDashboard {
 
     async loadScheduleSummary() {
         try {
-            const response = await fetch('/api/schedules');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/schedules');
             this.displayScheduleSummary(data);
         } catch (error) {
             console.error('Error loading schedule summary:', error);
@@ -311,9 +304,6 @@ class HospitalDashboard {
     startAutoRefresh() {
         // Update time every second
         this.intervals.push(setInterval(() => this.updateCurrentTime(), 1000));
-        
-        // Update data every 30 seconds
-        this.intervals.push(setInterval(() => this.loadOverviewData(), this.updateInterval));
     }
 
     async refreshAllData() {
@@ -348,7 +338,9 @@ class HospitalDashboard {
             'code_blue': 'CODE BLUE',
             'code_red': 'CODE RED',
             'general': 'GENERAL ALERT',
-            'emergency': 'EMERGENCY'
+            'emergency': 'EMERGENCY',
+            'low_stock': 'LOW STOCK',
+            'expiring_stock': 'EXPIRING STOCK'
         };
         return alertTitles[type] || 'ALERT';
     }
@@ -358,7 +350,9 @@ class HospitalDashboard {
             'code_blue': 'primary',
             'code_red': 'danger',
             'general': 'warning',
-            'emergency': 'danger'
+            'emergency': 'danger',
+            'low_stock': 'warning',
+            'expiring_stock': 'warning'
         };
         return badgeColors[type] || 'secondary';
     }
@@ -397,6 +391,7 @@ class HospitalDashboard {
     destroy() {
         this.intervals.forEach(interval => clearInterval(interval));
         this.intervals = [];
+        this.live.close();
     }
 }
 
@@ -0,0 +1,52 @@
+// Wenlock Hospital Smart Display System - Single Department Display JavaScript
+
+class DepartmentDisplay {
+    constructor(container) {
+        this.container = container;
+        this.department = container.dataset.department;
+        this.fragmentUrl = container.dataset.fragmentUrl;
+        this.updateInterval = 15000; // 15 seconds fallback polling when the live stream is down
+        this.html = null;
+        // Alerts raised for other wards are filtered out server-side
+        this.live = new LiveUpdates({ location: this.department }, {
+            reload: () => this.refresh(),
+            interval: this.updateInterval
+        });
+        this.startLiveUpdates();
+    }
+
+    startLiveUpdates() {
+        this.live.start({
+            // Token changes for other departments leave this screen untouched
+            tokens: (e) => {
+                const { changes } = JSON.parse(e.data);
+                if (!changes || changes.some(token => token.department === this.department)) {
+                    this.refresh();
+                }
+            },
+            alerts: () => this.refresh()
+        });
+    }
+
+    async refresh() {
+        try {
+            // The browser revalidates with the fragment's ETag, so unchanged screens get a 304
+            const response = await fetch(this.fragmentUrl);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const html = await response.text();
+            if (html !== this.html) {
+                this.html = html;
+                this.container.innerHTML = html;
+            }
+        } catch (error) {
+            console.error('Error refreshing department display:', error);
+        }
+    }
+}
+
+// Initialize department display when DOM is loaded
+document.addEventListener('DOMContentLoaded', () => {
+    window.departmentDisplay = new DepartmentDisplay(document.getElementById('departmentDisplay'));
+});
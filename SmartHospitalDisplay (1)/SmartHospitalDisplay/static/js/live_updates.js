@@ -0,0 +1,102 @@
+// Wenlock Hospital Smart Display System - Shared Live Update JavaScript
+
+class JsonFetcher {
+    constructor() {
+        this.responses = new Map();
+    }
+
+    async fetchJson(url) {
+        // Revalidate with the last ETag so unchanged data costs a bodyless 304
+        const cached = this.responses.get(url);
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+        const response = await fetch(url, { headers, cache: 'no-store' });
+
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const data = await response.json();
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            this.responses.set(url, { etag, data });
+        }
+        return data;
+    }
+}
+
+class LiveUpdates {
+    // Follows the live change stream with `params` as its query, polling every `interval` ms
+    // while it is down or when the server names no stream. `reload` loads everything;
+    // `poll` defaults to it.
+    constructor(params, { reload, poll = reload, interval }) {
+        const stream = document.querySelector('meta[name="live-stream"]')?.content;
+        const query = new URLSearchParams(params).toString();
+        this.url = stream ? (query ? `${stream}?${query}` : stream) : null;
+        this.reload = reload;
+        this.poll = poll;
+        this.interval = interval;
+        this.pollingInterval = null;
+        this.eventSource = null;
+        this.pendingReloads = {};
+    }
+
+    start(handlers) {
+        if (!this.url || !window.EventSource) {
+            this.startPolling();
+            return;
+        }
+
+        this.eventSource = new EventSource(this.url);
+        this.eventSource.addEventListener('open', () => {
+            // Reload once so nothing committed while disconnected is missed
+            if (this.pollingInterval) {
+                this.stopPolling();
+                this.reload();
+            }
+        });
+        this.eventSource.addEventListener('error', () => this.startPolling());
+        Object.entries(handlers).forEach(([event, handler]) => {
+            this.eventSource.addEventListener(event, handler);
+        });
+        this.eventSource.addEventListener('resync', () => this.reload());
+    }
+
+    coalesce(loaders) {
+        // Handlers that turn a burst of changes into a single reload per resource
+        return Object.fromEntries(Object.entries(loaders).map(([resource, loader]) => [
+            resource, () => this.scheduleReload(resource, loader)
+        ]));
+    }
+
+    scheduleReload(resource, loader) {
+        if (this.pendingReloads[resource]) return;
+        this.pendingReloads[resource] = setTimeout(() => {
+            delete this.pendingReloads[resource];
+            loader();
+        }, 250);
+    }
+
+    startPolling() {
+        if (!this.pollingInterval) {
+            this.pollingInterval = setInterval(() => this.poll(), this.interval);
+        }
+    }
+
+    stopPolling() {
+        clearInterval(this.pollingInterval);
+        this.pollingInterval = null;
+    }
+
+    close() {
+        this.stopPolling();
+        Object.values(this.pendingReloads).forEach(timeout => clearTimeout(timeout));
+        this.pendingReloads = {};
+
+        if (this.eventSource) {
+            this.eventSource.close();
+        }
+    }
+}
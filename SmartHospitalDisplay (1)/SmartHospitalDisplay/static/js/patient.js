@@ -2,9 +2,21 @@
 
 class PatientDisplay {
     constructor() {
-        this.updateInterval = 15000; // 15 seconds for patient display
+        this.updateInterval = 15000; // 15 seconds fallback polling when the live stream is down
         this.intervals = [];
+        this.fetcher = new JsonFetcher();
+        this.tokenState = { current_tokens: {}, queue: {} };
+        this.tokenCursor = null;
+        this.serviceRates = {}; // department -> estimated minutes per token
+        this.activeAlerts = [];
         this.alertSound = null;
+        // A screen opened with ?location=<ward> only shows that ward's alerts plus hospital-wide ones
+        this.location = new URLSearchParams(window.location.search).get('location');
+        this.live = new LiveUpdates(this.location ? { location: this.location } : {}, {
+            reload: () => this.loadPatientData(),
+            poll: () => this.pollPatientData(),
+            interval: this.updateInterval
+        });
         this.init();
     }
 
@@ -12,9 +24,29 @@ class PatientDisplay {
         console.log('PatientDisplay init called');
         this.loadPatientData();
         this.startAutoRefresh();
+        this.startLiveUpdates();
         this.setupAlertSound();
     }
 
+    locationUrl(url) {
+        return this.location ? `${url}?location=${encodeURIComponent(this.location)}` : url;
+    }
+
+    startLiveUpdates() {
+        this.live.start({
+            // Large batches arrive without row deltas and are reloaded instead
+            tokens: (e) => {
+                const { changes, service_rates: serviceRates } = JSON.parse(e.data);
+                this.serviceRates = serviceRates || this.serviceRates;
+                changes ? this.applyTokenChanges(changes) : this.loadTokens();
+            },
+            alerts: (e) => {
+                const { changes } = JSON.parse(e.data);
+                changes ? this.applyAlertChanges(changes) : this.loadAlerts();
+            }
+        });
+    }
+
     setupAlertSound() {
         // Create audio context for alert sounds (if needed)
         try {
@@ -27,8 +59,7 @@ class PatientDisplay {
     async loadPatientData() {
         try {
             await Promise.all([
-                this.loadCurrentTokens(),
-                this.loadQueue(),
+                this.loadTokens(),
                 this.loadAlerts()
             ]);
         } catch (error) {
@@ -37,23 +68,83 @@ class PatientDisplay {
         }
     }
 
-    async loadCurrentTokens() {
+    async pollPatientData() {
+        // Only the tokens changed since the last cursor come back while polling
+        await Promise.all([
+            this.tokenCursor === null ? this.loadTokens() : this.pollTokenChanges(),
+            this.loadAlerts()
+        ]);
+    }
+
+    async pollTokenChanges() {
         try {
-            console.log('Loading current tokens...');
-            const response = await fetch('/api/tokens');
-            console.log('Response status:', response.status);
-            
+            const response = await fetch(`/api/tokens?since=${this.tokenCursor}`, { cache: 'no-store' });
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
-            
             const data = await response.json();
+
+            // Removed tokens can't be matched to a current token number, so reload then
+            if (data.reset || data.removed.length > 0) {
+                await this.loadTokens();
+                return;
+            }
+            this.tokenCursor = data.cursor;
+            this.serviceRates = data.service_rates || this.serviceRates;
+            if (data.changes.length > 0) {
+                this.applyTokenChanges(data.changes);
+            }
+        } catch (error) {
+            console.error('Error polling token changes:', error);
+        }
+    }
+
+    async loadTokens() {
+        try {
+            console.log('Loading tokens...');
+            const data = await this.fetcher.fetchJson('/api/tokens');
             console.log('Tokens data:', data);
-            this.displayCurrentTokens(data.current_tokens || {});
+            // Copy so live deltas never touch the revalidation cache
+            this.tokenState = {
+                current_tokens: { ...data.current_tokens },
+                queue: { ...data.queue }
+            };
+            this.tokenCursor = data.cursor;
+            this.serviceRates = data.service_rates || {};
         } catch (error) {
-            console.error('Error loading current tokens:', error);
-            this.displayCurrentTokens({});
+            console.error('Error loading tokens:', error);
+            this.tokenState = { current_tokens: {}, queue: {} };
         }
+        this.displayCurrentTokens(this.tokenState.current_tokens);
+        this.displayQueue(this.tokenState.queue);
+    }
+
+    applyTokenChanges(changes) {
+        const { current_tokens: currentTokens, queue } = this.tokenState;
+
+        changes.forEach(token => {
+            const dept = token.department;
+            const queueList = (queue[dept] || []).filter(item => item.id !== token.id);
+
+            if (token.is_current) {
+                currentTokens[dept] = token.token_number;
+            } else if (currentTokens[dept] === token.token_number) {
+                delete currentTokens[dept];
+            }
+
+            if (!token.is_current && token.status === 'waiting') {
+                queueList.push(token);
+            }
+
+            if (queueList.length > 0) {
+                queue[dept] = queueList;
+            } else {
+                delete queue[dept];
+            }
+        });
+
+        this.displayCurrentTokens(currentTokens);
+        this.displayQueue(queue);
     }
 
     displayCurrentTokens(currentTokens) {
@@ -92,25 +183,6 @@ class PatientDisplay {
         currentTokensContainer.innerHTML = `<div class="row">${tokensHtml}</div>`;
     }
 
-    async loadQueue() {
-        try {
-            console.log('Loading queue...');
-            const response = await fetch('/api/tokens');
-            console.log('Queue response status:', response.status);
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            
-            const data = await response.json();
-            console.log('Queue data:', data);
-            this.displayQueue(data.queue || {});
-        } catch (error) {
-            console.error('Error loading queue:', error);
-            this.displayQueue({});
-        }
-    }
-
     displayQueue(queue) {
         const queueContainer = document.getElementById('queueContainer');
         if (!queueContainer) return;
@@ -130,11 +202,14 @@ class PatientDisplay {
 
         const queueHtml = departments.map(dept => {
             const queueList = queue[dept] || [];
-            const queueItems = queueList.slice(0, 10).map(item => `
+            // Position in the queue times the department's recent pace
+            const rate = this.serviceRates[dept];
+            const queueItems = queueList.slice(0, 10).map((item, index) => `
                 <div class="queue-item">
                     <div>
                         <div class="queue-number">${item.token_number}</div>
                         <small class="text-muted">${item.patient_type || 'General'}</small>
+                        ${rate ? `<small class="text-muted ms-2"><i class="fas fa-hourglass-half"></i> ~${Math.round(rate * (index + 1))} min</small>` : ''}
                     </div>
                     <div class="queue-status ${item.status || 'waiting'}">${this.formatStatus(item.status || 'waiting')}</div>
                 </div>
@@ -163,13 +238,23 @@ class PatientDisplay {
 
     async loadAlerts() {
         try {
-            const response = await fetch('/api/alerts');
-            const data = await response.json();
-            this.displayAlerts(data.active_alerts || []);
+            const data = await this.fetcher.fetchJson(this.locationUrl('/api/alerts'));
+            this.activeAlerts = data.active_alerts || [];
         } catch (error) {
             console.error('Error loading alerts:', error);
-            this.displayAlerts([]);
+            this.activeAlerts = [];
         }
+        this.displayAlerts(this.activeAlerts);
+    }
+
+    applyAlertChanges(changes) {
+        changes.forEach(alert => {
+            this.activeAlerts = this.activeAlerts.filter(item => item.id !== alert.id);
+            if (alert.active) {
+                this.activeAlerts.unshift(alert);
+            }
+        });
+        this.displayAlerts(this.activeAlerts);
     }
 
     displayAlerts(alerts) {
@@ -178,7 +263,7 @@ class PatientDisplay {
 
         // Filter alerts relevant to patients
         const patientAlerts = alerts.filter(alert => 
-            alert.type !== 'staff_only' && alert.active
+            !['staff_only', 'low_stock', 'expiring_stock'].includes(alert.type) && alert.active
         );
 
         if (patientAlerts.length === 0) {
@@ -240,9 +325,7 @@ class PatientDisplay {
     }
 
     startAutoRefresh() {
-        // Update data every 15 seconds
-        this.intervals.push(setInterval(() => this.loadPatientData(), this.updateInterval));
-        
+        // Data arrives over the live stream; only the clock ticks here
         // Update time display every second
         this.intervals.push(setInterval(() => this.updateTimeDisplay(), 1000));
     }
@@ -350,6 +433,7 @@ class PatientDisplay {
     destroy() {
         this.intervals.forEach(interval => clearInterval(interval));
         this.intervals = [];
+        this.live.close();
         
         if (this.audioContext) {
             this.audioContext.close();
@@ -2,17 +2,31 @@
 
 class StaffPanel {
     constructor() {
-        this.updateInterval = 10000; // 10 seconds for staff panel
+        this.updateInterval = 10000; // 10 seconds fallback polling when the live stream is down
         this.intervals = [];
+        this.fetcher = new JsonFetcher();
+        this.live = new LiveUpdates({}, {
+            reload: () => this.loadStaffData(),
+            interval: this.updateInterval
+        });
         this.init();
     }
 
     init() {
         this.loadStaffData();
-        this.startAutoRefresh();
+        this.startLiveUpdates();
         this.setupEventListeners();
     }
 
+    startLiveUpdates() {
+        this.live.start(this.live.coalesce({
+            tokens: () => this.loadTokenStatus(),
+            alerts: () => this.loadActiveAlerts(),
+            inventory: () => this.loadInventoryStatus(),
+            schedules: () => this.loadScheduleStatus()
+        }));
+    }
+
     setupEventListeners() {
         // Alert creation form
         const alertForm = document.getElementById('alertForm');
@@ -61,8 +75,7 @@ class StaffPanel {
 
     async loadActiveAlerts() {
         try {
-            const response = await fetch('/api/alerts');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/alerts');
             this.displayActiveAlerts(data.active_alerts || []);
         } catch (error) {
             console.error('Error loading alerts:', error);
@@ -197,8 +210,7 @@ class StaffPanel {
 
     async loadInventoryStatus() {
         try {
-            const response = await fetch('/api/inventory');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/inventory');
             this.displayInventoryStatus(data);
         } catch (error) {
             console.error('Error loading inventory status:', error);
@@ -307,43 +319,31 @@ class StaffPanel {
         
         const formData = new FormData(e.target);
         const department = formData.get('department');
-        const tokenNumber = formData.get('tokenNumber');
+        const tokenNumber = (formData.get('tokenNumber') || '').trim();
+
+        // The server assigns the next number for the department unless one is given
+        const tokenData = { department, patient_type: 'General' };
+        if (tokenNumber) {
+            tokenData.token_number = tokenNumber;
+        }
 
         try {
-            // Get current token data
-            const response = await fetch('/api/tokens');
-            const data = await response.json();
-            
-            // Initialize department if it doesn't exist
-            if (!data.current_tokens) data.current_tokens = {};
-            if (!data.queue) data.queue = {};
-            if (!data.queue[department]) data.queue[department] = [];
-
-            // Add token to queue
-            const newToken = {
-                token_number: tokenNumber,
-                patient_type: 'General',
-                status: 'waiting',
-                timestamp: new Date().toISOString()
-            };
-
-            data.queue[department].push(newToken);
-
-            // Save updated tokens
-            const updateResponse = await fetch('/api/tokens', {
+            const response = await fetch('/api/tokens', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify(data)
+                body: JSON.stringify(tokenData)
             });
 
-            if (updateResponse.ok) {
-                this.showSuccess(`Token ${tokenNumber} added to ${department} queue`);
+            const result = await response.json();
+
+            if (response.ok) {
+                this.showSuccess(`Token ${result.token.token_number} added to ${department} queue`);
                 e.target.reset();
                 await this.loadTokenStatus();
             } else {
-                this.showError('Failed to add token');
+                this.showError(result.message || 'Failed to add token');
             }
         } catch (error) {
             console.error('Error adding token:', error);
@@ -360,46 +360,23 @@ class StaffPanel {
         const operation = formData.get('operation');
 
         try {
-            // Get current inventory
-            const response = await fetch('/api/inventory');
-            const data = await response.json();
-            
-            // Find and update the item
-            const allItems = { ...data.medications, ...data.supplies };
-            if (allItems[itemName]) {
-                if (operation === 'add') {
-                    allItems[itemName].quantity += quantity;
-                } else if (operation === 'subtract') {
-                    allItems[itemName].quantity = Math.max(0, allItems[itemName].quantity - quantity);
-                } else {
-                    allItems[itemName].quantity = quantity;
-                }
+            // The server applies the change atomically and records it in the stock ledger
+            const response = await fetch('/api/inventory', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ item_name: itemName, quantity, operation })
+            });
 
-                // Update the appropriate category
-                if (data.medications[itemName]) {
-                    data.medications[itemName] = allItems[itemName];
-                } else {
-                    data.supplies[itemName] = allItems[itemName];
-                }
+            const result = await response.json();
 
-                // Save updated inventory
-                const updateResponse = await fetch('/api/inventory', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify(data)
-                });
-
-                if (updateResponse.ok) {
-                    this.showSuccess('Inventory updated successfully');
-                    e.target.reset();
-                    await this.loadInventoryStatus();
-                } else {
-                    this.showError('Failed to update inventory');
-                }
+            if (response.ok) {
+                this.showSuccess(`${itemName} updated: ${result.item.quantity} ${result.item.unit} in stock`);
+                e.target.reset();
+                await this.loadInventoryStatus();
             } else {
-                this.showError('Item not found in inventory');
+                this.showError(result.message || 'Failed to update inventory');
             }
         } catch (error) {
             console.error('Error updating inventory:', error);
@@ -409,8 +386,7 @@ class StaffPanel {
 
     async loadTokenStatus() {
         try {
-            const response = await fetch('/api/tokens');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/tokens');
             this.displayTokenStatus(data);
         } catch (error) {
             console.error('Error loading token status:', error);
@@ -506,8 +482,7 @@ class StaffPanel {
 
     async loadScheduleStatus() {
         try {
-            const response = await fetch('/api/schedules');
-            const data = await response.json();
+            const data = await this.fetcher.fetchJson('/api/schedules');
             this.displayScheduleStatus(data);
         } catch (error) {
             console.error('Error loading schedule status:', error);
@@ -626,11 +601,6 @@ class StaffPanel {
         scheduleStatusContainer.innerHTML = scheduleHtml;
     }
 
-    startAutoRefresh() {
-        // Update data every 10 seconds
-        this.intervals.push(setInterval(() => this.loadStaffData(), this.updateInterval));
-    }
-
     async refreshAllData() {
         const refreshBtn = document.getElementById('refreshBtn');
         if (refreshBtn) {
@@ -671,7 +641,9 @@ class StaffPanel {
             'code_red': 'danger',
             'general': 'warning',
             'emergency': 'danger',
-            'maintenance': 'info'
+            'maintenance': 'info',
+            'low_stock': 'warning',
+            'expiring_stock': 'warning'
         };
         return badgeColors[type] || 'secondary';
     }
@@ -748,6 +720,7 @@ class StaffPanel {
     destroy() {
         this.intervals.forEach(interval => clearInterval(interval));
         this.intervals = [];
+        this.live.close();
     }
 }
 
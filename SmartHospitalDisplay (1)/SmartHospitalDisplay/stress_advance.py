@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Concurrency harness for token advancement.
+
+Seeds a few departments with waiting tokens, fires hundreds of parallel
+POST /api/tokens/advance/<department> requests and checks that the queue
+invariants still hold. Runs against the database in DATABASE_URL, which
+it clears first.
+
+    DATABASE_URL=sqlite:////tmp/stress.db python stress_advance.py --advances 400
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db, Token
+
+
+def seed_queues(departments, tokens_per_department):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for department in departments:
+            prefix = department[0].upper()
+            for number in range(1, tokens_per_department + 1):
+                db.session.add(Token(department=department, token_number=f"{prefix}{number:03d}",
+                                     status='waiting', is_current=False))
+        db.session.commit()
+
+
+def advance(department):
+    with app.test_client() as client:
+        response = client.post(f'/api/tokens/advance/{department}')
+        return department, response.status_code, response.get_json()
+
+
+def check_invariants(departments, tokens_per_department, advances_per_department, results):
+    failures = []
+
+    errors = [result for result in results if result[1] != 200]
+    if errors:
+        failures.append(f"{len(errors)} advance(s) failed, first: {errors[0]}")
+
+    promoted = Counter(result[2]['token']['id'] for result in results
+                       if result[1] == 200 and result[2]['status'] == 'success')
+    promoted_twice = [token_id for token_id, count in promoted.items() if count > 1]
+    if promoted_twice:
+        failures.append(f"tokens promoted more than once: {promoted_twice}")
+
+    expected_promotions = len(departments) * min(advances_per_department, tokens_per_department)
+    if sum(promoted.values()) != expected_promotions:
+        failures.append(f"expected {expected_promotions} promotions, got {sum(promoted.values())}")
+
+    with app.app_context():
+        for department in departments:
+            tokens = Token.query.filter_by(department=department).all()
+            statuses = Counter(token.status for token in tokens)
+            current = [token for token in tokens if token.is_current]
+
+            if len(current) > 1:
+                failures.append(f"{department}: {len(current)} current tokens")
+            if any(token.status != 'in_progress' for token in current):
+                failures.append(f"{department}: current token not in progress")
+            if statuses['in_progress'] != len(current):
+                failures.append(f"{department}: {statuses['in_progress']} in progress but {len(current)} current")
+
+            served = min(advances_per_department, tokens_per_department)
+            expected_completed = served - 1 if advances_per_department <= tokens_per_department else served
+            if statuses['completed'] != expected_completed:
+                failures.append(f"{department}: expected {expected_completed} completed, got {statuses['completed']}")
+            if statuses['waiting'] != tokens_per_department - served:
+                failures.append(f"{department}: expected {tokens_per_department - served} waiting, "
+                                f"got {statuses['waiting']}")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--departments', type=int, default=4)
+    parser.add_argument('--tokens', type=int, default=150, help='waiting tokens seeded per department')
+    parser.add_argument('--advances', type=int, default=400, help='total advance requests')
+    parser.add_argument('--workers', type=int, default=32, help='parallel request threads')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    departments = [f"dept{index}" for index in range(args.departments)]
+    advances_per_department = args.advances // len(departments)
+
+    seed_queues(departments, args.tokens)
+    requests = [department for _ in range(advances_per_department) for department in departments]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(advance, requests))
+
+    failures = check_invariants(departments, args.tokens, advances_per_department, results)
+    print(f"{len(results)} advances across {len(departments)} departments with {args.workers} workers")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("All queue invariants hold")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Concurrency harness for inventory updates.
+
+Seeds a few items, fires parallel POST /api/inventory requests (mostly
+dispensing, with some restocking) and checks that no update was lost:
+every item's final quantity must equal its opening stock plus the
+accepted changes, must never go negative, and must match the stock
+ledger. Runs against the database in DATABASE_URL, which it clears first.
+
+    DATABASE_URL=sqlite:////tmp/stress.db python stress_dispense.py --requests 1000
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import logging
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db, InventoryItem, StockMovement, record_opening_stock
+
+
+def seed_items(items, opening_stock):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for name in items:
+            db.session.add(InventoryItem(name=name, quantity=opening_stock, unit='tablets', min_threshold=10,
+                                         max_capacity=opening_stock * 2, category='Stress', item_type='medication'))
+        db.session.commit()
+        record_opening_stock()
+
+
+def update(change):
+    name, operation, quantity = change
+    with app.test_client() as client:
+        response = client.post('/api/inventory', json={
+            'item_name': name, 'operation': operation, 'quantity': quantity, 'actor': 'stress'
+        })
+        return change, response.status_code
+
+
+def check_invariants(items, opening_stock, results):
+    failures = []
+
+    errors = [result for result in results if result[1] not in (200, 409)]
+    if errors:
+        failures.append(f"{len(errors)} update(s) failed, first: {errors[0]}")
+
+    expected = Counter({name: opening_stock for name in items})
+    for (name, operation, quantity), status in results:
+        if status == 200:
+            expected[name] += quantity if operation == 'add' else -quantity
+
+    with app.app_context():
+        for name in items:
+            item = InventoryItem.query.filter_by(name=name).one()
+            ledger = db.session.query(db.func.sum(StockMovement.change)).filter_by(item_id=item.id).scalar()
+            movements = StockMovement.query.filter_by(item_id=item.id).count()
+            accepted = sum(1 for (change_name, _, _), status in results if change_name == name and status == 200)
+
+            if item.quantity != expected[name]:
+                failures.append(f"{name}: quantity {item.quantity}, expected {expected[name]} (lost updates)")
+            if item.quantity < 0:
+                failures.append(f"{name}: negative stock {item.quantity}")
+            if ledger != item.quantity:
+                failures.append(f"{name}: ledger sums to {ledger} but quantity is {item.quantity}")
+            if movements != accepted + 1:
+                failures.append(f"{name}: {movements} ledger rows for {accepted} accepted updates")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=3)
+    parser.add_argument('--stock', type=int, default=500, help='opening stock per item')
+    parser.add_argument('--requests', type=int, default=1000, help='total update requests')
+    parser.add_argument('--workers', type=int, default=32, help='parallel request threads')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    items = [f"Stress Item {index}" for index in range(args.items)]
+    rng = random.Random(42)
+    # Dispensing outpaces restocking, so some items run out and later requests must be refused
+    changes = [(rng.choice(items), 'add' if rng.random() < 0.2 else 'subtract', rng.randint(1, 5))
+               for _ in range(args.requests)]
+
+    seed_items(items, args.stock)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(update, changes))
+
+    failures = check_invariants(items, args.stock, results)
+    refused = sum(1 for _, status in results if status == 409)
+    print(f"{len(results)} updates across {len(items)} items with {args.workers} workers, "
+          f"{refused} refused for insufficient stock")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("No lost updates; quantities match the ledger")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Load test for the push gateway under thousands of idle ward displays.
+
+Starts push_gateway.py --wsgi and advances department queues with no
+displays connected, for a baseline. It then opens thousands of /api/stream
+connections, holds them idle past a keepalive and advances the queues
+again while they are all connected. Reports advance_token latency both
+ways, how long each change took to reach every display, and the gateway's
+memory. Fails if a display is dropped or the displays add more than
+--max-added-ms to advance p95. Runs against the database in DATABASE_URL,
+which it clears first.
+
+The baseline makes the check hold on any machine, including one where the
+displays' client shares the gateway's CPU. Pass --max-advance-ms to also
+hold p99 under a fixed limit; 50 ms at 5,000 displays needs at least two
+cores, so the client isn't competing with the gateway.
+
+    DATABASE_URL=sqlite:////tmp/stress.db python stress_displays.py --displays 5000 --advances 100
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import subprocess
+from http.client import HTTPConnection
+from time import perf_counter, sleep
+
+from app import app, db, Token, SSE_KEEPALIVE_SECONDS
+from benchmark_token_queries import percentile
+from push_gateway import raise_open_file_limit
+
+CONNECT_CONCURRENCY = 200  # displays connecting at once
+
+
+def seed_queues(departments, tokens_per_department):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(db.insert(Token), [
+            {'department': department, 'token_number': f"{department[0].upper()}{number:03d}",
+             'patient_type': 'General', 'status': 'waiting', 'is_current': False}
+            for department in departments for number in range(1, tokens_per_department + 1)
+        ])
+        db.session.commit()
+
+
+def start_gateway(port):
+    gateway = subprocess.Popen([sys.executable, 'push_gateway.py', '--port', str(port), '--wsgi'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            connection = HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/tokens/counters')
+            connection.getresponse().read()
+            return gateway
+        except OSError:
+            sleep(0.1)
+    gateway.kill()
+    raise RuntimeError("push gateway did not start")
+
+
+def resident_megabytes(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+class Display(asyncio.Protocol):
+    """One ward screen's stream, recording when each tokens event arrives"""
+
+    def __init__(self, department, arrivals, ready):
+        self.department = department
+        self.arrivals = arrivals  # tokens event index -> arrival times, shared by all displays
+        self.ready = ready
+        self.connected = False
+        self.keepalives = 0
+        self.tokens_events = 0
+
+    def connection_made(self, transport):
+        transport.write(f"GET /api/stream?location={self.department} HTTP/1.1\r\n"
+                        f"Host: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode())
+
+    def data_received(self, data):
+        if not self.connected and b"event: hello\n" in data:
+            self.connected = True
+            self.ready()
+        arrived = perf_counter()
+        for _ in range(data.count(b"event: tokens\n")):
+            self.arrivals.setdefault(self.tokens_events, []).append(arrived)
+            self.tokens_events += 1
+        self.keepalives += data.count(b": keepalive\n")
+
+    def connection_lost(self, exc):
+        self.connected = False
+
+
+def advance_queues(port, departments, advances, interval, results):
+    """POST /api/tokens/advance/<department> round-robin over one keep-alive connection.
+
+    Runs in its own process, so reading the displays' streams doesn't delay its timings.
+    """
+    connection = HTTPConnection('127.0.0.1', port)
+    for number in range(advances):
+        sleep(interval)
+        start = perf_counter()
+        connection.request('POST', f"/api/tokens/advance/{departments[number % len(departments)]}")
+        response = connection.getresponse()
+        response.read()
+        results.put((start, (perf_counter() - start) * 1000, response.status))
+
+
+def timed_advances(port, departments, advances, interval):
+    """Run advance_queues in its own process; returns (start, latency ms, status) per advance"""
+    results = multiprocessing.Queue()
+    writer = multiprocessing.Process(target=advance_queues, args=(port, departments, advances, interval, results))
+    writer.start()
+    timings = [results.get(timeout=60) for _ in range(advances)]
+    writer.join()
+    return timings
+
+
+async def run(port, displays, departments, advances, interval, idle_seconds):
+    loop = asyncio.get_running_loop()
+    arrivals = {}
+    all_connected = asyncio.Event()
+    connected = 0
+
+    def ready():
+        nonlocal connected
+        connected += 1
+        if connected == displays:
+            all_connected.set()
+
+    async def connect(department):
+        async with semaphore:
+            _, screen = await loop.create_connection(lambda: Display(department, arrivals, ready), '127.0.0.1', port)
+        return screen
+
+    start = perf_counter()
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    screens = await asyncio.gather(*(connect(departments[index % len(departments)]) for index in range(displays)))
+    await all_connected.wait()
+    print(f"{displays:,} displays connected in {perf_counter() - start:.1f}s; idle for {idle_seconds:g}s")
+    await asyncio.sleep(idle_seconds)
+
+    timings = await loop.run_in_executor(None, timed_advances, port, departments, advances, interval)
+    await asyncio.sleep(1)  # let the last change reach every display
+
+    dropped = sum(1 for screen in screens if not screen.connected)
+    return screens, dropped, timings, arrivals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--displays', type=int, default=5000)
+    parser.add_argument('--departments', type=int, default=10)
+    parser.add_argument('--advances', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between advances, across all departments')
+    parser.add_argument('--idle-seconds', type=float, default=SSE_KEEPALIVE_SECONDS + 5,
+                        help='how long the displays sit idle before the advances start')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--max-added-ms', type=float, default=25,
+                        help='most the displays may add to advance p95 over the baseline')
+    parser.add_argument('--max-advance-ms', type=float, help='p99 advance latency to stay under as well')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    raise_open_file_limit()
+    departments = [f"dept{index}" for index in range(args.departments)]
+    # Enough waiting tokens for the baseline and the run with displays
+    seed_queues(departments, 2 * args.advances // args.departments + 1)
+
+    gateway = start_gateway(args.port)
+    try:
+        baseline = [latency for _, latency, _ in timed_advances(args.port, departments, args.advances, args.interval)]
+        idle_megabytes = resident_megabytes(gateway.pid)
+        screens, dropped, results, arrivals = asyncio.run(run(args.port, args.displays, departments, args.advances,
+                                                              args.interval, args.idle_seconds))
+        loaded_megabytes = resident_megabytes(gateway.pid)
+    finally:
+        gateway.terminate()
+        gateway.wait()
+
+    latencies = [latency for _, latency, _ in results]
+    # How long after each advance was sent its change reached the last display
+    fan_out = [(max(arrivals[index]) - start) * 1000
+               for index, (start, _, _) in enumerate(results) if len(arrivals.get(index, ())) == args.displays]
+
+    for label, sample in (("no displays", baseline), (f"{args.displays:,} displays", latencies)):
+        print(f"{len(sample)} advances, {label}: p50 {percentile(sample, 50):.1f}ms, "
+              f"p95 {percentile(sample, 95):.1f}ms, p99 {percentile(sample, 99):.1f}ms, max {max(sample):.1f}ms")
+    if fan_out:
+        print(f"change reached all {args.displays:,} displays: p50 {percentile(fan_out, 50):.1f}ms, "
+              f"p99 {percentile(fan_out, 99):.1f}ms")
+    print(f"gateway memory: {idle_megabytes:.0f} MB idle, {loaded_megabytes:.0f} MB with the displays "
+          f"({(loaded_megabytes - idle_megabytes) * 1024 / args.displays:.1f} KB each)")
+
+    failures = []
+    errors = [status for _, _, status in results if status != 200]
+    if errors:
+        failures.append(f"{len(errors)} advance(s) failed with status {errors[0]}")
+    if dropped:
+        failures.append(f"{dropped} display(s) disconnected")
+    if args.idle_seconds > SSE_KEEPALIVE_SECONDS and any(screen.keepalives == 0 for screen in screens):
+        failures.append("some displays got no keepalive while idle")
+    if len(fan_out) < len(results):
+        failures.append(f"{len(results) - len(fan_out)} change(s) missed some display")
+    added = percentile(latencies, 95) - percentile(baseline, 95)
+    if added > args.max_added_ms:
+        failures.append(f"the displays added {added:.1f}ms to advance p95, over {args.max_added_ms:g}ms")
+    if args.max_advance_ms is not None and percentile(latencies, 99) > args.max_advance_ms:
+        failures.append(f"advance p99 over {args.max_advance_ms:g}ms")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("Every display stayed connected and advances stayed within budget")
+
+if __name__ == '__main__':
+    main()